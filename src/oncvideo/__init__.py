@@ -3,9 +3,13 @@ from .utils import onc, name_to_timestamp, name_to_timestamp_dc
 from .list_files import list_file, list_file_batch
 from .dives_onc import get_dives
 from .video_info import video_info
-from .didson_file import didson_info, read_ddf
-from .extract_frame import extract_frame, extract_fov
-from .timelapse import make_timelapse, align_frames
+from .didson_file import didson_info, read_ddf, iter_ddf, DidsonFile
+from .didson_video import didson_video, fan_image
+from .didson_store import didson_convert, read_didson_h5
+from .didson_summary import didson_summary
+from .extract_frame import extract_frame, extract_fov, iter_frames
+from .thumbnails import make_thumbnails
+from .timelapse import make_timelapse, align_frames, warp_frames
 from .download_files import download_files, to_mp4
 from .ts_download import download_ts, merge_ts, read_ts
 from .seatube import download_st, link_st, rename_st
@@ -15,9 +19,12 @@ __all__ = [
     'list_file', 'list_file_batch',
     'get_dives',
     'video_info',
-    'didson_info', 'read_ddf',
-    'extract_frame', 'extract_fov',
-    'make_timelapse', 'align_frames',
+    'didson_info', 'read_ddf', 'iter_ddf', 'DidsonFile',
+    'didson_video', 'fan_image',
+    'didson_convert', 'read_didson_h5', 'didson_summary',
+    'extract_frame', 'extract_fov', 'iter_frames',
+    'make_thumbnails',
+    'make_timelapse', 'align_frames', 'warp_frames',
     'download_files', 'to_mp4',
     'download_ts', 'merge_ts', 'read_ts',
     'download_st', 'link_st', 'rename_st'
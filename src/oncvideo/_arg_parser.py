@@ -7,8 +7,12 @@ from .list_files import list_file, list_file_batch
 from .dives_onc import get_dives
 from .video_info import video_info
 from .didson_file import didson_info
+from .didson_video import didson_video
+from .didson_store import didson_convert
+from .didson_summary import didson_summary
 from .extract_frame import extract_frame, extract_fov
-from .timelapse import make_timelapse, align_frames
+from .thumbnails import make_thumbnails
+from .timelapse import make_timelapse, align_frames, warp_frames
 from .download_files import download_files, to_mp4
 from .ts_download import download_ts, merge_ts
 from .seatube import download_st, link_st, rename_st
@@ -60,7 +64,29 @@ def fdidson(args):
     """
     run didson_info function
     """
-    didson_info(args.source, args.output)
+    didson_info(args.source, args.output, args.sample, args.jobs)
+
+
+def fdidsonvideo(args):
+    """
+    run didson_video function
+    """
+    didson_video(args.source, args.output, args.width, args.fps, args.target_quality,
+        args.preset, args.h265)
+
+
+def fdidsonconvert(args):
+    """
+    run didson_convert function
+    """
+    didson_convert(args.source, args.output, args.chunk_size, args.level)
+
+
+def fdidsonsummary(args):
+    """
+    run didson_summary function
+    """
+    didson_summary(args.source, args.output, args.bins, args.threshold, args.width)
 
 
 def fdownload(args):
@@ -74,8 +100,12 @@ def fextframe(args):
     """
     run extract_frame function
     """
+    if args.resize is not None:
+        args.resize = [int(x) for x in args.resize.split(',')]
     extract_frame(args.source, args.interval, args.output,
-                  args.trim, args.deinterlace, args.rounding_near)
+                  args.trim, args.deinterlace, args.rounding_near,
+                  args.output_format, args.resize, args.scene_threshold,
+                  args.scene_min_interval, args.dedupe)
 
 
 def ftomp4(args):
@@ -94,7 +124,15 @@ def fextfov(args):
     if args.timestamps is not None:
         args.timestamps = args.timestamps.split(",")
     extract_fov(args.source, args.timestamps, args.clip_or_sharpest,
-                args.duration, args.output, args.deinterlace)
+                args.duration, args.output, args.deinterlace, args.dedupe)
+
+
+def fthumbnails(args):
+    """
+    run make_thumbnails function
+    """
+    make_thumbnails(args.source, args.interval, args.output, args.columns,
+                    args.rows, args.width, args.trim, args.deinterlace)
 
 
 def fdownloadts(args):
@@ -166,13 +204,22 @@ def fmaketimelapse(args):
     args.time_xy = point2int(args.time_xy)
     args.caption_xy = point2int(args.caption_xy)
     make_timelapse(args.folder, args.time_display, args.time_format, args.time_offset,
-                    args.fps, args.fontSize, args.logo, args.caption, args.time_xy, args.caption_xy)
+                    args.fps, args.fontSize, args.logo, args.caption, args.time_xy, args.caption_xy,
+                    args.target_quality, args.preset, args.h265, args.jobs, args.segments,
+                    args.transforms, align_method=args.align, reference=args.reference)
 
 def falign(args):
     """
     align images
     """
-    align_frames(args.folder, args.method, args.reference)
+    align_frames(args.folder, args.method, args.reference, jobs=args.jobs,
+                 save_images=not args.no_images)
+
+def fwarp(args):
+    """
+    warp images with saved transforms
+    """
+    warp_frames(args.folder)
 
 
 def main(args=None):
@@ -270,8 +317,57 @@ def main(args=None):
     subparser_didson.add_argument('source', help=help_input)
     subparser_didson.add_argument('-o', '--output', default="DIDSON_info.csv",
         help="File name to write information. Default 'DIDSON_info.csv'")
+    subparser_didson.add_argument('-s', '--sample', type=int,
+        help="Read only the headers of this number of frames, evenly spaced in the file. \
+        Default will read all frames.")
+    subparser_didson.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of files read concurrently. Default 1.')
     subparser_didson.set_defaults(func=fdidson)
 
+    # Render DIDSON files as videos
+    subparser_didsonvideo = subparsers.add_parser(
+        'videoDIDSON', help="Render DIDSON files as videos (fan-shaped images)")
+    subparser_didsonvideo.add_argument('source', help=help_input)
+    subparser_didsonvideo.add_argument('-o', '--output', default="DIDSON_video",
+        help="Folder to save the videos. Default 'DIDSON_video'")
+    subparser_didsonvideo.add_argument('-w', '--width', type=int, default=800,
+        help="Width of the video, in pixels. Default 800.")
+    subparser_didsonvideo.add_argument('-r', '--fps', type=float,
+        help="Video FPS. Default is the frame rate recorded in the DIDSON file.")
+    subparser_didsonvideo.add_argument('-crf', '--target_quality', type=float,
+        help='Set CRF (quality level) in ffmpeg.')
+    subparser_didsonvideo.add_argument('--preset', default='medium',
+        help="Encoding preset in ffmpeg (e.g. 'fast', 'medium', 'slow'). Default 'medium'.")
+    subparser_didsonvideo.add_argument('-p', '--h265', action="store_true",
+        help='Use H.265 encoding instead of H.264.')
+    subparser_didsonvideo.set_defaults(func=fdidsonvideo)
+
+    # Convert DIDSON files to HDF5
+    subparser_didsonconvert = subparsers.add_parser(
+        'convertDIDSON', help="Convert DIDSON files to compressed HDF5 files (requires h5py)")
+    subparser_didsonconvert.add_argument('source', help=help_input)
+    subparser_didsonconvert.add_argument('-o', '--output', default="DIDSON_h5",
+        help="Folder to save the HDF5 files. Default 'DIDSON_h5'")
+    subparser_didsonconvert.add_argument('-c', '--chunk_size', type=int, default=64,
+        help="Number of frames in each compressed chunk. Default 64.")
+    subparser_didsonconvert.add_argument('-l', '--level', type=int, default=4,
+        help="gzip compression level, from 0 to 9. Default 4.")
+    subparser_didsonconvert.set_defaults(func=fdidsonconvert)
+
+    # Summarize DIDSON files
+    subparser_didsonsummary = subparsers.add_parser(
+        'summaryDIDSON', help="Summarize DIDSON files as mean/max images and echograms")
+    subparser_didsonsummary.add_argument('source', help=help_input)
+    subparser_didsonsummary.add_argument('-o', '--output', default="DIDSON_summary",
+        help="Folder to save the images and the csv file. Default 'DIDSON_summary'")
+    subparser_didsonsummary.add_argument('-b', '--bins', type=int, default=128,
+        help="Number of range bins in the echogram. Default 128.")
+    subparser_didsonsummary.add_argument('-t', '--threshold', type=int, default=0,
+        help="Frames without any sample above this intensity are considered empty. Default 0.")
+    subparser_didsonsummary.add_argument('-w', '--width', type=int, default=400,
+        help="Width of the mean and max images, in pixels. Default 400.")
+    subparser_didsonsummary.set_defaults(func=fdidsonsummary)
+
     # Download
     subparser_download = subparsers.add_parser(
         'download', help="Download files")
@@ -319,6 +415,19 @@ def main(args=None):
     subparser_extframe.add_argument('-n', '--rounding_near', action="store_true",
         help='Use ffmpeg default Timestamp rounding method (near) for fps filter.\
         Default to False (stills start in the beginning of the video).')
+    subparser_extframe.add_argument('-f', '--output_format', choices=['jpg', 'hdf5'], default='jpg',
+        help="Save frames as jpg images or in a compressed HDF5 file (requires h5py). Default 'jpg'.")
+    subparser_extframe.add_argument('-r', '--resize',
+        help="Resize frames before saving in the HDF5 file. Must be two ints (width,height) \
+        separated by comma.")
+    subparser_extframe.add_argument('-s', '--scene_threshold', type=float,
+        help="Extract frames adaptively, when the scene score (0 to 1) is above this threshold. \
+        'interval' will be the maximum time between frames.")
+    subparser_extframe.add_argument('--scene_min_interval', type=float, default=1,
+        help="Minimum time, in seconds, between frames extracted due to a scene change. Default 1.")
+    subparser_extframe.add_argument('-u', '--dedupe', type=int,
+        help="Do not save frames that are near-duplicates of recent frames, i.e. the Hamming \
+        distance between their perceptual hashes is lower or equal to this value (e.g. 5).")
     subparser_extframe.set_defaults(func=fextframe)
 
     # extract FOV
@@ -339,8 +448,31 @@ def main(args=None):
         help="Folder to download files. Default 'fovs'")
     subparser_extframe.add_argument('-d', '--deinterlace', action="store_true",
         help='Deinterlace video before getting frame. Default to False.')
+    subparser_extframe.add_argument('-u', '--dedupe', type=int,
+        help="Do not save frames that are near-duplicates of recent frames in the same FOV, \
+        i.e. the Hamming distance between their perceptual hashes is lower or equal to this value (e.g. 5).")
     subparser_extframe.set_defaults(func=fextfov)
 
+    # contact sheets
+    subparser_thumbnails = subparsers.add_parser(
+        'thumbnails', help="Generate contact sheets (tiled thumbnails) from video files")
+    subparser_thumbnails.add_argument('source', help=help_input)
+    subparser_thumbnails.add_argument('interval', type=float, nargs='?', default=10,
+        help="Get thumbnails every 'X' seconds. Default to 10 seconds.")
+    subparser_thumbnails.add_argument('-o', '--output', default="thumbnails",
+        help="Folder to save contact sheets. Default 'thumbnails'")
+    subparser_thumbnails.add_argument('-c', '--columns', type=int, default=10,
+        help="Number of thumbnails in each row of the contact sheet. Default 10.")
+    subparser_thumbnails.add_argument('-r', '--rows', type=int, default=10,
+        help="Number of rows in each contact sheet. Default 10.")
+    subparser_thumbnails.add_argument('-w', '--width', type=int, default=320,
+        help="Width of each thumbnail, in pixels. Default 320.")
+    subparser_thumbnails.add_argument('-t', '--trim', action="store_true",
+        help='Trim video files to match the initial search query.')
+    subparser_thumbnails.add_argument('-d', '--deinterlace', action="store_true",
+        help='Deinterlace video. Default to False.')
+    subparser_thumbnails.set_defaults(func=fthumbnails)
+
     # download time series
     subparser_downloadts = subparsers.add_parser(
         'downloadTS', help="Donwload timeseries data that corresponds to the same \
@@ -429,6 +561,25 @@ def main(args=None):
         help="Coordinates of the bottom-left corner of the time text. Must be two ints separated by comma")
     subparser_maketimelapse.add_argument('--caption_xy',
         help="Coordinates of the bottom-left corner of the caption. Must be two ints separated by comma.")
+    subparser_maketimelapse.add_argument('-crf', '--target_quality', type=float,
+        help='Set CRF (quality level) in ffmpeg.')
+    subparser_maketimelapse.add_argument('--preset', default='medium',
+        help="Encoding preset in ffmpeg (e.g. 'fast', 'medium', 'slow'). Default 'medium'.")
+    subparser_maketimelapse.add_argument('-p', '--h265', action="store_true",
+        help='Use H.265 encoding instead of H.264.')
+    subparser_maketimelapse.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of folders (FOVs) to process in parallel. Default 1.')
+    subparser_maketimelapse.add_argument('-s', '--segments', action="store_true",
+        help='Write video segments and a HLS playlist (.m3u8), so new frames can be appended \
+        without rewriting the whole video. Cannot be used with --h265.')
+    subparser_maketimelapse.add_argument('-a', '--transforms',
+        help="Path to the output folder of 'align' (e.g. 'fovs_aligned'). Frames are aligned \
+        with the saved transforms while creating the timelapse.")
+    subparser_maketimelapse.add_argument('-m', '--align', choices=['ORB', 'ECC', 'ORB+ECC', 'PHASE'],
+        help="Align frames while creating the timelapse, with the given method (check 'align').")
+    subparser_maketimelapse.add_argument('--reference', default="middle",
+        help="Reference frame to align frames, if --align is used. Can be 'first', 'middle', 'last', \
+        'previousX' or filename of the image to be used. Default 'middle'.")
     subparser_maketimelapse.set_defaults(func=fmaketimelapse)
 
 
@@ -437,13 +588,25 @@ def main(args=None):
         'align', help="Align frames")
     subparser_align.add_argument('folder', default="fovs",
         help="Path to a folder where .jpg images are stored. Default 'fovs'.")
-    subparser_align.add_argument('-m', '--method', choices=['ORB', 'ECC', 'ORB+ECC'], default="ORB+ECC",
-        help="Algorithm used for alignment: Feature Matching (ORB), ECC Image Alignment, or both.")
+    subparser_align.add_argument('-m', '--method', choices=['ORB', 'ECC', 'ORB+ECC', 'PHASE'], default="ORB+ECC",
+        help="Algorithm used for alignment: Feature Matching (ORB), ECC Image Alignment, or both. \
+        'PHASE' estimates only translations with phase correlation, falling back to ORB+ECC.")
     subparser_align.add_argument('-r', '--reference', default="middle",
         help="Define the reference frame which other frames will be aligned to. Can be \
             'first', 'middle', 'last', 'previousX' or filename of the image to be used. Default 'middle'.")
+    subparser_align.add_argument('-j', '--jobs', type=int, default=1,
+        help='Number of processes used to align the frames. Default 1.')
+    subparser_align.add_argument('-n', '--no_images', action="store_true",
+        help="Do not save aligned images, only the transforms (transforms.csv).")
     subparser_align.set_defaults(func=falign)
 
+    # Warp frames
+    subparser_warp = subparsers.add_parser(
+        'warp', help="Align frames using transforms saved by 'align'")
+    subparser_warp.add_argument('folder', default="fovs",
+        help="Path to a folder where .jpg images are stored. Default 'fovs'.")
+    subparser_warp.set_defaults(func=fwarp)
+
     args = parser.parse_args(args)
     args.func(args)
 
@@ -1,10 +1,15 @@
 """ Multiple helper functions used for the package"""
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from string import Template
 from pathlib import Path
+import subprocess as sp
+import tempfile
+import json
 import requests
 import numpy as np
 import pandas as pd
+import cv2
 import backoff
 from tqdm.auto import tqdm
 from ffmpeg_progress_yield import FfmpegProgress
@@ -115,6 +120,168 @@ def run_ffmpeg(cmd, filename=''):
             pbar.update(progress - pbar.n)
 
 
+def video_size(urlfile):
+    """
+    Get width and height of the first video stream using ffprobe
+    """
+    ffprobe_cmd = ['ffprobe', '-v', 'quiet',
+                    '-select_streams', 'v:0',
+                    '-show_entries', 'stream=width,height',
+                    '-of', 'json',
+                    '-i', urlfile]
+
+    out_raw = sp.check_output(ffprobe_cmd)
+    stream = json.loads(out_raw)['streams'][0]
+    return stream['width'], stream['height']
+
+
+def pipe_frames(cmd, width, height):
+    """
+    Run a ffmpeg command that writes rawvideo (bgr24) to stdout
+    and yield one frame at a time as a numpy array
+    """
+    frame_size = width * height * 3
+    # stderr goes to a file, so a full pipe can't block ffmpeg
+    with tempfile.TemporaryFile() as ferr:
+        proc = sp.Popen(cmd, stdout=sp.PIPE, stderr=ferr)
+        try:
+            while True:
+                buffer = bytearray(frame_size)
+                if proc.stdout.readinto(buffer) < frame_size:
+                    break
+                yield np.frombuffer(buffer, np.uint8).reshape(height, width, 3)
+
+            # stream was drained, check if ffmpeg finished without errors
+            if proc.wait() != 0:
+                ferr.seek(0)
+                raise RuntimeError(f"ffmpeg failed to decode video: {cmd[cmd.index('-i') + 1]}\n"
+                    + ferr.read().decode(errors='replace').strip())
+        finally:
+            proc.stdout.close()
+            proc.kill()
+            proc.wait()
+
+
+def filter_path(path):
+    """
+    Escape a file path to be used as an option in a ffmpeg filter
+    """
+    return str(path).replace('\\', '/').replace(':', '\\\\:')
+
+
+def read_metadata(path):
+    """
+    Read the output of the ffmpeg metadata filter (mode=print)
+    Return a DataFrame with pts_time and metadata keys for each frame
+    """
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('frame:'):
+                pts_time = line.split('pts_time:')[-1]
+                rows.append({'pts_time': float(pts_time)})
+            elif '=' in line and len(rows) > 0:
+                key, value = line.split('=', 1)
+                rows[-1][key] = value
+
+    return pd.DataFrame(rows, columns=['pts_time'] if len(rows) == 0 else None)
+
+
+def prefetch(func, items, n=2):
+    """
+    Apply func to items in a thread pool, running up to n items
+    ahead, and yield the results in the same order as items
+    """
+    executor = ThreadPoolExecutor(max_workers=n)
+    futures = deque()
+    try:
+        for item in items:
+            futures.append(executor.submit(func, item))
+            if len(futures) > n:
+                yield futures.popleft().result()
+
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def dhash(img, hash_size=8):
+    """
+    Compute the difference hash (dHash) of an image
+    Return the hash as an int of hash_size * hash_size bits
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    img = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = img[:, 1:] > img[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class DuplicateIndex:
+    """
+    Keep the hashes of the last frames saved, to check if
+    a new frame is a near-duplicate of one of them
+    """
+    def __init__(self, max_distance, size=10):
+        self.max_distance = max_distance
+        self.hashes = deque(maxlen=size)
+
+    def check(self, img, name):
+        """
+        Return the name of a recent frame within max_distance (Hamming
+        distance) of img. If none is found, add img to the index and return None
+        """
+        img_hash = dhash(img)
+        for h, n in self.hashes:
+            if (h ^ img_hash).bit_count() <= self.max_distance:
+                return n
+
+        self.hashes.append((img_hash, name))
+        return None
+
+
+def open_ffmpeg_writer(output, width, height, fps, crf=None, preset='medium', h265=False,
+    metadata=None, pix_fmt='bgr24', extra=None):
+    """
+    Start a ffmpeg process that encodes rawvideo frames written to its stdin
+    Frames with odd width or height are padded, as required by yuv420p
+    """
+    encoder = 'libx265' if h265 else 'libx264'
+    crfv = [] if crf is None else ['-crf', str(crf)]
+    metadatav = [] if metadata is None else ['-metadata', f"comment={metadata}"]
+    extra = [] if extra is None else extra
+
+    cmd = ['ffmpeg', '-v', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', pix_fmt,
+        '-s', f'{width}x{height}', '-r', str(fps), '-i', 'pipe:',
+        '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', encoder, '-preset', preset
+        ] + crfv + ['-pix_fmt', 'yuv420p'] + metadatav + extra + [output]
+
+    return sp.Popen(cmd, stdin=sp.PIPE)
+
+
+def close_ffmpeg_writer(proc):
+    """
+    Close stdin of the ffmpeg process and wait the encoding to finish
+    """
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError(f"ffmpeg failed to encode video: {proc.args[-1]}")
+
+
+def import_h5py():
+    """
+    Import h5py, which is an optional dependency
+    """
+    try:
+        import h5py
+    except ImportError as e:
+        raise ImportError("h5py is required to write HDF5 files. "
+            "Install it with 'pip install oncvideo[hdf5]'.") from e
+    return h5py
+
+
 def to_timedelta(x):
     """
     Convert number of seconds to pandas.Timedelta object
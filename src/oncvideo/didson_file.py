@@ -1,22 +1,33 @@
 """Read DDF v3 files (DIDSON)"""
 import io
-from datetime import datetime
+import re
+from datetime import datetime, timezone
+from bisect import bisect_left, bisect_right
+from functools import partial
 from pathlib import Path
 import numpy as np
 import pandas as pd
 import requests
 from tqdm.auto import tqdm
 
-from ._utils import parse_file_path, strftd
+from ._utils import parse_file_path, strftd, prefetch
 
 
-def _handle_file(urlfile):
+def _handle_file(urlfile, stream=False):
     """
     Return a file connection if string is a URL or a path to a file
+    stream - URLs are read as they are downloaded, instead of in memory
     """
     if urlfile.startswith("https"):
-        r = requests.get(urlfile, timeout=10)
-        if r.status_code == 200 and r.content != b'':
+        r = requests.get(urlfile, timeout=10, stream=stream)
+        if r.status_code != 200:
+            r.close()
+            raise ValueError("Could not get URL: " + urlfile)
+
+        if stream:
+            f = r.raw
+            f.decode_content = True
+        elif r.content != b'':
             f = io.BytesIO(r.content)
         else:
             raise ValueError("Could not get URL: " + urlfile)
@@ -30,111 +41,321 @@ def _handle_file(urlfile):
     return f
 
 
-def _read_ddf_info(urlfile):
+# https://wiki.oceannetworks.ca/download/attachments/49447779/DIDSON%20V5.26.26%20Data%20File%20and%20Ethernet%20Structure.pdf?version=1&modificationDate=1654558351000&api=v2
+# DDF_03, file header (512 bytes)
+FILE_HEADER = np.dtype({
+    'names': ['filetype', 'version', 'nframe', 'framerate', 'resolution', 'num_beams', 'num_samples'],
+    'formats': ['S3', 'u1', '<i4', '<i4', '<i4', '<i4', '<i4'],
+    'offsets': [0, 3, 4, 8, 12, 16, 24],
+    'itemsize': 512
+})
+
+FRAME_HEADER_SIZE = 256
+
+CONTENT_RANGE = re.compile(rb'content-range: *bytes (\d+)-(\d+)', re.IGNORECASE)
+
+# window start multiplier and window length options, for
+# classic windows (CW), extended windows (XW) with LR and standard range
+WINDOW_START = np.array([0.375, 0.42, 0.42])
+WINDOW_LENGTH = np.array([
+    (1.125, 2.25, 4.5, 9, 18, 36),
+    (2.5, 5, 10, 20, 40, 80),
+    (1.25, 2.5, 5, 10, 20, 40)
+])
+
+
+def _frame_dtype(nbytes):
     """
-    Read headers of ddf v3 file, but skip actual data
+    Return the dtype of a frame (header of 256 bytes followed by the samples)
+    Use nbytes=0 for the frame header only
     """
-    f = _handle_file(urlfile)
+    return np.dtype({
+        'names': ['pctime', 'year', 'month', 'day', 'hour', 'minute', 'second', 'hsecond',
+                  'window_start', 'window_length', 'flags', 'samples'],
+        'formats': ['<i4', '<i4', '<i4', '<i4', '<i4', '<i4', '<i4', '<i4',
+                    '<i4', '<i4', 'u1', ('u1', nbytes)],
+        'offsets': [4, 20, 24, 28, 32, 36, 40, 44, 52, 56, 192, FRAME_HEADER_SIZE],
+        'itemsize': FRAME_HEADER_SIZE + nbytes
+    })
+
 
-    # https://wiki.oceannetworks.ca/download/attachments/49447779/DIDSON%20V5.26.26%20Data%20File%20and%20Ethernet%20Structure.pdf?version=1&modificationDate=1654558351000&api=v2
-    # DDF_03
-    filetype = f.read(3)
-    if filetype != b'DDF':
+def _parse_header(data):
+    """
+    Parse the file header of a ddf v3 file
+    """
+    header = np.frombuffer(data, dtype=FILE_HEADER, count=1)[0]
+    if header['filetype'] != b'DDF':
         raise ValueError("File is not a DDF file")
-    version = int.from_bytes(f.read(1), "little")
-    if version != 3:
+    if header['version'] != 3:
         raise ValueError("Only DDF V3 file supported")
+    return header
 
-    nframe = int.from_bytes(f.read(4), "little")
-    framerate = int.from_bytes(f.read(4), "little")
-    resolution = int.from_bytes(f.read(4), "little") # 1=HF, 0=LF
-    num_beams = int.from_bytes(f.read(4), "little")
-    f.seek(4, 1)
-    num_samples = int.from_bytes(f.read(4), "little") # samples_per_channel
-    nbytes = num_beams*num_samples + 60
-
-    f.seek(484, 1)
-
-    time = pd.Series(np.datetime64('now'), index=range(nframe))
-    pctime = pd.Series(np.datetime64('now'), index=range(nframe))
-    window_start = np.empty(nframe)
-    window_length = np.empty(nframe)
-    # sonarPan = np.empty(nframe)
-    # sonarTilt = np.empty(nframe)
-    # sonarRoll = np.empty(nframe)
-
-    for i in range(nframe):
-        f.seek(4, 1)
-        dt=int.from_bytes(f.read(4), "little")
-        pctime[i] = datetime.fromtimestamp(dt)
-        f.seek(12, 1)
-
-        # f.seek(20, 1)
-        time[i] = pd.Timestamp(
-            year=int.from_bytes(f.read(4), "little"),
-            month=int.from_bytes(f.read(4), "little"),
-            day=int.from_bytes(f.read(4), "little"),
-            hour=int.from_bytes(f.read(4), "little"),
-            minute=int.from_bytes(f.read(4), "little"),
-            second=int.from_bytes(f.read(4), "little"),
-            microsecond=int.from_bytes(f.read(4), "little")*10000
-        )
-        f.seek(4, 1)
-        window_start_i = int.from_bytes(f.read(4), "little")
-        window_length_i = int.from_bytes(f.read(4), "little")
-
-        # f.seek(100, 1)
-        # sonarPan[i] = struct.unpack('f', f.read(4))[0]
-        # sonarTilt[i] = struct.unpack('f', f.read(4))[0]
-        # sonarRoll[i] = struct.unpack('f', f.read(4))[0]
-        # f.seek(20, 1)
-
-        f.seek(132, 1) # comment if above is uncommented
-
-        b = f.read(4)
-        windowtype = b[0] & 0x1 # 1=classic, 0=extended windows
-        rangetype = (b[0] >> 1) & 0x1 # 0=Standard, 1=LR
-
-        if windowtype:  # CW
-            window_start_multiplier = 0.375
-            window_length_options = (1.125, 2.25, 4.5, 9, 18, 36)
-        else:  # XW
-            window_start_multiplier = 0.42
-            if rangetype:  # LR
-                window_length_options = (2.5, 5, 10, 20, 40, 80)
-            else:  # Std
-                window_length_options = (1.25, 2.5, 5, 10, 20, 40)
-
-        if resolution == 0: # If is LF
-            window_length_i += 2
-            window_start_multiplier *= 2
-
-        window_start[i] = window_start_i * window_start_multiplier
-        window_length[i] = window_length_options[window_length_i]
-
-        f.seek(nbytes, 1)
 
-    f.close()
+def _map_ddf(urlfile):
+    """
+    Map a ddf v3 file as a structured array, without reading the samples
+    Local files are memory-mapped, URLs are downloaded
+    Return the file header and the frames
+    """
+    f = _handle_file(urlfile)
+    try:
+        header = _parse_header(f.read(FILE_HEADER.itemsize))
+        dtype = _frame_dtype(int(header['num_beams']) * int(header['num_samples']))
+        nframe = int(header['nframe'])
 
-    pc_time_from = pctime.iloc[0].strftime('%Y-%m-%d %H:%M:%S')
-    pc_time_to = pctime.iloc[-1].strftime('%Y-%m-%d %H:%M:%S')
+        if isinstance(f, io.BytesIO):
+            frames = np.frombuffer(f.getvalue(), dtype=dtype, count=nframe, offset=FILE_HEADER.itemsize)
+        else:
+            frames = np.memmap(f, dtype=dtype, mode='r', offset=FILE_HEADER.itemsize, shape=(nframe,))
+    finally:
+        f.close()
+
+    return header, frames
+
+
+def _get_ranges(url, ranges):
+    """
+    Get byte ranges (start, end inclusive) of a URL with a HTTP Range request
+    Return a list of (start, bytes) of the parts received, or None if the
+    server does not support Range requests
+    """
+    range_header = 'bytes=' + ','.join(f'{start}-{end}' for start, end in ranges)
+    r = requests.get(url, headers={'Range': range_header}, timeout=10, stream=True)
+
+    if r.status_code != 206:
+        r.close()
+        if r.status_code == 200:
+            return None
+        raise ValueError("Could not get URL: " + url)
+
+    content_type = r.headers.get('Content-Type', '')
+    if not content_type.startswith('multipart/byteranges'):
+        # only one range, or all ranges merged by the server
+        start = int(r.headers['Content-Range'].split()[1].split('-')[0])
+        return [(start, r.content)]
+
+    # parse multipart/byteranges response, each part has its own Content-Range
+    content = r.content
+    parts = []
+    pos = 0
+    while True:
+        match = CONTENT_RANGE.search(content, pos)
+        if match is None:
+            break
+        start, end = int(match.group(1)), int(match.group(2))
+        data_start = content.index(b'\r\n\r\n', match.end()) + 4
+        data_end = data_start + end - start + 1
+        parts.append((start, content[data_start:data_end]))
+        pos = data_end
+
+    return parts
+
+
+def _read_ranges(url, ranges, batch_size=200):
+    """
+    Read byte ranges of a URL, with multiple ranges in each request
+    Return a list of bytes for each range, or None if the server
+    does not support Range requests or does not return all the ranges
+    """
+    out = []
+    for i in range(0, len(ranges), batch_size):
+        batch = ranges[i:i + batch_size]
+        parts = _get_ranges(url, batch)
+        if parts is None:
+            return None
+
+        # servers may merge adjacent ranges, so find the part with each range
+        parts.sort(key=lambda part: part[0])
+        starts = [start for start, _ in parts]
+        for start, end in batch:
+            k = bisect_right(starts, start) - 1
+            if k < 0:
+                return None
+            part_start, data = parts[k]
+            # servers may also return only some of the ranges, or short parts
+            if end - part_start + 1 > len(data):
+                return None
+            out.append(data[start - part_start:end - part_start + 1])
+
+    return out
+
+
+def _range_reader(url):
+    """
+    Return a function that reads a list of byte ranges of a URL with HTTP
+    Range requests. If the server answers any request without the ranges, the
+    whole file is downloaded once and all ranges are read from it
+    """
+    content = None
+
+    def read(ranges):
+        nonlocal content
+        if content is None:
+            data = _read_ranges(url, ranges)
+            if data is not None:
+                return data
+
+            f = _handle_file(url)
+            content = f.getvalue()
+            f.close()
 
+        return [content[start:end + 1] for start, end in ranges]
+
+    return read
+
+
+def _sample_index(nframe, sample):
+    """
+    Index of frames evenly spaced, always including the first,
+    second and last frames
+    """
+    index = np.linspace(0, nframe - 1, max(sample, 3)).round().astype(int)
+    return np.unique(np.concatenate([[0, min(1, nframe - 1)], index]))
+
+
+def _fetch_ddf_headers(url, sample=None):
+    """
+    Read only the file header and frame headers of a remote ddf v3 file,
+    with HTTP Range requests. Fall back to download the whole file if
+    Range requests are not supported.
+    Return the file header and the frame headers
+    """
+    read = _range_reader(url)
+    header = _parse_header(read([(0, FILE_HEADER.itemsize - 1)])[0])
+    nframe = int(header['nframe'])
+    frame_size = _frame_dtype(int(header['num_beams']) * int(header['num_samples'])).itemsize
+
+    index = np.arange(nframe) if sample is None else _sample_index(nframe, sample)
+    offsets = FILE_HEADER.itemsize + index * frame_size
+    ranges = [(int(offset), int(offset) + FRAME_HEADER_SIZE - 1) for offset in offsets]
+
+    frames = np.frombuffer(b''.join(read(ranges)), dtype=_frame_dtype(0))
+
+    return header, frames
+
+
+def _utc_naive(time):
+    """
+    Convert a time to a pandas.Timestamp comparable with the sonar times,
+    which are UTC without time zone
+    """
+    time = pd.Timestamp(time)
+    if time.tzinfo is not None:
+        time = time.tz_convert('UTC').tz_localize(None)
+    return time
+
+
+def _search_frames(frame_header, nframe, time_from, time_to):
+    """
+    Binary search the positions of the first frame at or after time_from and
+    after the last frame at or before time_to, reading only log(n) frame headers
+    frame_header - function that returns the header of the frame at a position
+    """
+    def key(i):
+        return _sonar_time(frame_header(i)).iloc[0]
+
+    start = 0 if time_from is None else bisect_left(
+        range(nframe), _utc_naive(time_from), key=key)
+    stop = nframe if time_to is None else bisect_right(
+        range(nframe), _utc_naive(time_to), key=key)
+
+    return start, max(start, stop)
+
+
+def _map_ddf_window(urlfile, time_from, time_to):
+    """
+    Map only the frames of a ddf v3 file between two times (inclusive,
+    time zone aware times are converted to UTC)
+    Local files are memory-mapped, URLs are read with HTTP Range requests
+    (or downloaded, if Range requests are not supported)
+    Return the file header and the frames
+    """
+    if not urlfile.startswith("https"):
+        header, frames = _map_ddf(urlfile)
+        start, stop = _search_frames(lambda i: frames[i:i + 1], len(frames), time_from, time_to)
+        return header, frames[start:stop]
+
+    read = _range_reader(urlfile)
+    header = _parse_header(read([(0, FILE_HEADER.itemsize - 1)])[0])
+    dtype = _frame_dtype(int(header['num_beams']) * int(header['num_samples']))
+
+    def offset(i):
+        return FILE_HEADER.itemsize + i * dtype.itemsize
+
+    def frame_header(i):
+        data = read([(offset(i), offset(i) + FRAME_HEADER_SIZE - 1)])[0]
+        return np.frombuffer(data, dtype=_frame_dtype(0))
+
+    start, stop = _search_frames(frame_header, int(header['nframe']), time_from, time_to)
+
+    # frames in the window are contiguous, so a single range is needed
+    data = read([(offset(start), offset(stop) - 1)])[0] if stop > start else b''
+    frames = np.frombuffer(data, dtype=dtype, count=stop - start)
+
+    return header, frames
+
+
+def _sonar_time(frames):
+    """
+    Get the sonar timestamp of frames as a pandas Series
+    """
+    time = pd.DataFrame({k: frames[k] for k in ('year', 'month', 'day', 'hour', 'minute', 'second')})
+    time = pd.to_datetime(time).astype('datetime64[ns]')
+    return time + pd.to_timedelta(frames['hsecond'] * 10, unit='ms')
+
+
+def _window(frames, resolution):
+    """
+    Get the window start and window length (in meters) of frames
+    """
+    windowtype = frames['flags'] & 0x1 # 1=classic, 0=extended windows
+    rangetype = (frames['flags'] >> 1) & 0x1 # 0=Standard, 1=LR
+    row = np.where(windowtype, 0, np.where(rangetype, 1, 2))
+
+    window_start = frames['window_start'] * WINDOW_START[row]
+    window_length = frames['window_length']
+
+    if resolution == 0: # If is LF
+        window_length = window_length + 2
+        window_start = window_start * 2
+
+    return window_start, WINDOW_LENGTH[row, window_length]
+
+
+def _read_ddf_info(urlfile, sample=None):
+    """
+    Read headers of ddf v3 file, but skip actual data
+    """
+    if urlfile.startswith("https"):
+        header, frames = _fetch_ddf_headers(urlfile, sample)
+    else:
+        header, frames = _map_ddf(urlfile)
+        if sample is not None:
+            frames = frames[_sample_index(len(frames), sample)]
+
+    # only first and last PC time are used, in UTC as in DidsonFile
+    pctime = frames['pctime'][[0, -1]]
+    pc_time_from = datetime.fromtimestamp(pctime[0], tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    pc_time_to = datetime.fromtimestamp(pctime[1], tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+    time = _sonar_time(frames)
     sonar_time_from = time.iloc[0].strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
     sonar_time_to = time.iloc[-1].strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
     duration_secs = round((time.iloc[-1]-time.iloc[1]).total_seconds())
     duration = strftd(duration_secs)
 
+    window_start, window_length = _window(frames, header['resolution'])
     ws = ';'.join(np.unique(window_start).astype(str).tolist())
     wl = ';'.join(np.unique(window_length).astype(str).tolist())
 
     # pc_time_from, pc_time_to, SonartimeFrom, SonartimeTo, duration,
     # framerate, nBeams, nSamples, windowStart, windowLength
-    info = (f'{pc_time_from},{pc_time_to},{sonar_time_from},{sonar_time_to},'
-        f'{duration},{framerate},{num_beams},{num_samples},{ws},{wl}')
+    info = (f"{pc_time_from},{pc_time_to},{sonar_time_from},{sonar_time_to},"
+        f"{duration},{header['framerate']},{header['num_beams']},{header['num_samples']},{ws},{wl}")
     return info
 
-def read_ddf(urlfile):
+def read_ddf(urlfile, lazy=False, time_from=None, time_to=None):
     """
     Get data from DIDSON file
 
@@ -142,65 +363,295 @@ def read_ddf(urlfile):
     ----------
     urlfile : str
         Path to a file or a URL.
+    lazy : bool, default False
+        If True, return a read-only view of the samples instead of a copy.
+        For local files, the view is memory-mapped and data is only read from
+        disk when accessed, so large files can be sliced (e.g. out[100:200],
+        out[:, 10]) without loading the whole file into memory.
+    time_from : str, datetime or pandas.Timestamp, default None
+        Read frames from this time (inclusive). Default is the first frame.
+    time_to : str, datetime or pandas.Timestamp, default None
+        Read frames up to this time (inclusive). Default is the last frame.
+        If time_from or time_to are given, the frames are found with a binary
+        search over the frame headers and only the frames in the window are
+        read. For URLs, HTTP Range requests are used if supported by the server.
+        Times without time zone are taken as UTC.
 
     Returns
     -------
-    numpy.array
-        A 1d array with the timestamp for each frame.
+    pandas.Series
+        The timestamp for each frame.
 
     numpy.array
         A 3d array as [frame, Beams, Samples].
     """
-    f = _handle_file(urlfile)
+    if time_from is None and time_to is None:
+        header, frames = _map_ddf(urlfile)
+    else:
+        header, frames = _map_ddf_window(urlfile, time_from, time_to)
 
-    # https://wiki.oceannetworks.ca/download/attachments/49447779/DIDSON%20V5.26.26%20Data%20File%20and%20Ethernet%20Structure.pdf?version=1&modificationDate=1654558351000&api=v2
-    # DDF_03
-    filetype = f.read(3)
-    if filetype != b'DDF':
-        raise ValueError("File is not a DDF file")
-    version = int.from_bytes(f.read(1), "little")
-    if version != 3:
-        raise ValueError("Only DDF V3 file supported")
+    time = _sonar_time(frames)
 
-    nframe = int.from_bytes(f.read(4), "little")
-    f.seek(8, 1)
-    num_beams = int.from_bytes(f.read(4), "little")
-    f.seek(4, 1)
-    num_samples = int.from_bytes(f.read(4), "little")
-    nbytes = num_beams*num_samples
-
-    f.seek(484, 1)
-
-    out = np.empty((nframe, num_beams, num_samples), dtype=np.uint8)
-    time = pd.Series(np.datetime64('now'), index=range(nframe))
-
-    for i in range(nframe):
-        f.seek(20, 1)
-        time[i] = pd.Timestamp(
-            year=int.from_bytes(f.read(4), "little"),
-            month=int.from_bytes(f.read(4), "little"),
-            day=int.from_bytes(f.read(4), "little"),
-            hour=int.from_bytes(f.read(4), "little"),
-            minute=int.from_bytes(f.read(4), "little"),
-            second=int.from_bytes(f.read(4), "little"),
-            microsecond=int.from_bytes(f.read(4), "little")*10000
-        )
-        f.seek(208, 1)
-
-        b = f.read(nbytes)
-        out[i,:,:] = np.frombuffer(b, dtype=np.uint8).reshape(num_beams, num_samples, order='F')
+    # samples are stored as [Samples, Beams] in each frame
+    samples = frames['samples'].reshape(len(frames), header['num_samples'], header['num_beams'])
+    out = samples.transpose(0, 2, 1)
+
+    if not lazy:
+        out = np.ascontiguousarray(out)
 
-    f.close()
     return time, out
 
 
-def didson_info(source, output='DIDSON_info.csv'):
+def _readinto(f, buffer):
+    """
+    Read from f until buffer (a memoryview) is full or the file ends
+    Return the number of bytes read
+    """
+    nread = 0
+    while nread < len(buffer):
+        n = f.readinto(buffer[nread:])
+        if not n:
+            break
+        nread += n
+    return nread
+
+
+def iter_ddf(urlfile, batch_size=100):
+    """
+    Iterate over frames of DIDSON file in batches
+
+    Frames are read sequentially, from disk or as they are downloaded, and
+    the same buffers are reused for all batches, so files of any size can be
+    processed with constant memory.
+
+    Parameters
+    ----------
+    urlfile : str
+        Path to a file or a URL.
+    batch_size : int, default 100
+        Number of frames in each batch. The last batch may be smaller.
+
+    Yields
+    ------
+    pandas.Series
+        The timestamp for each frame in the batch.
+
+    numpy.array
+        A 3d array as [frame, Beams, Samples]. The array is overwritten by the
+        next batch, so copy it if it needs to be kept.
+
+    Examples
+    --------
+    >>> total = None
+    >>> for time, frames in iter_ddf('file.ddf', 500):
+    ...     batch_sum = frames.sum(axis=0, dtype=np.uint64)
+    ...     total = batch_sum if total is None else total + batch_sum
+    """
+    f = _handle_file(urlfile, stream=True)
+    try:
+        header = _parse_header(f.read(FILE_HEADER.itemsize))
+        num_beams, num_samples = int(header['num_beams']), int(header['num_samples'])
+        dtype = _frame_dtype(num_beams * num_samples)
+        nframe = int(header['nframe'])
+
+        buffer = bytearray(batch_size * dtype.itemsize)
+        out = np.empty((batch_size, num_beams, num_samples), dtype=np.uint8)
+
+        for start in range(0, nframe, batch_size):
+            n = min(batch_size, nframe - start)
+            nbytes = _readinto(f, memoryview(buffer)[:n * dtype.itemsize])
+            n = nbytes // dtype.itemsize
+            if n == 0:
+                break
+
+            frames = np.frombuffer(buffer, dtype=dtype, count=n)
+            # samples are stored as [Samples, Beams] in each frame
+            samples = frames['samples'].reshape(n, num_samples, num_beams)
+            np.copyto(out[:n], samples.transpose(0, 2, 1))
+
+            yield _sonar_time(frames), out[:n]
+    finally:
+        f.close()
+
+
+class DidsonFile:
+    """
+    DIDSON file (DDF v3) with random access to frames
+
+    Headers are parsed once when the file is opened. Frames of local files are
+    memory-mapped, so only the frames accessed are read from disk (URLs are
+    downloaded when opened). Frames can be indexed by position or by time,
+    and are returned as arrays of [Beams, Samples]. Times without time zone
+    are taken as UTC.
+
+    Parameters
+    ----------
+    urlfile : str
+        Path to a file or a URL.
+
+    Attributes
+    ----------
+    nframe : int
+        Number of frames.
+    framerate : int
+        Frame rate recorded in the file header.
+    resolution : int
+        1 if high frequency (HF), 0 if low frequency (LF).
+    num_beams : int
+        Number of beams.
+    num_samples : int
+        Number of samples per beam.
+    time : pandas.Series
+        Sonar timestamp of each frame.
+    pctime : pandas.Series
+        PC timestamp of each frame (UTC).
+    window_start : numpy.array
+        Window start (distance from DIDSON to first sample, in meters) of each frame.
+    window_length : numpy.array
+        Window length (distance from first sample to the last, in meters) of each frame.
+    offsets : numpy.array
+        Byte offset of each frame in the file.
+
+    Examples
+    --------
+    >>> with DidsonFile('file.ddf') as ddf:
+    ...     frame = ddf[10]
+    ...     frames = ddf['2022-11-08 16:10':'2022-11-08 16:11']
+    ...     for time, frames in ddf.iter_chunks(100):
+    ...         pass
+    """
+    def __init__(self, urlfile):
+        self.urlfile = urlfile
+        header, self._frames = _map_ddf(urlfile)
+
+        self.nframe = len(self._frames)
+        self.framerate = int(header['framerate'])
+        self.resolution = int(header['resolution'])
+        self.num_beams = int(header['num_beams'])
+        self.num_samples = int(header['num_samples'])
+
+        self.time = _sonar_time(self._frames)
+        self.pctime = pd.Series(pd.to_datetime(self._frames['pctime'], unit='s'))
+        self.window_start, self.window_length = _window(self._frames, self.resolution)
+        self.offsets = FILE_HEADER.itemsize + np.arange(self.nframe, dtype=np.int64) * self._frames.itemsize
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.nframe
+
+    def __repr__(self):
+        return (f"DidsonFile('{self.urlfile}', nframe={self.nframe}, "
+                f"num_beams={self.num_beams}, num_samples={self.num_samples})")
+
+    def __getitem__(self, key):
+        """
+        Get frames by position (int or slice) or by time (str, datetime,
+        or slice of these). A single time returns the frame at or
+        immediately before the given time.
+        """
+        if isinstance(key, slice):
+            # frames between start and stop times, inclusive
+            start = key.start if _is_position(key.start) else self._search(key.start, 'left')
+            stop = key.stop if _is_position(key.stop) else self._search(key.stop, 'right')
+            key = slice(start, stop, key.step)
+        elif not _is_position(key):
+            key = self.frame_index(key)
+
+        return self._read(key)
+
+    def frame_index(self, time):
+        """
+        Get the position of the frame at or immediately before a given time
+
+        Parameters
+        ----------
+        time : str, datetime or pandas.Timestamp
+            Timestamp to search.
+
+        Returns
+        -------
+        int
+            Position of the frame.
+        """
+        return max(self._search(time, 'right') - 1, 0)
+
+    def iter_chunks(self, chunk_size=100):
+        """
+        Iterate over frames in chunks
+
+        Parameters
+        ----------
+        chunk_size : int, default 100
+            Number of frames in each chunk.
+
+        Yields
+        ------
+        pandas.Series
+            The timestamp for each frame in the chunk.
+
+        numpy.array
+            A 3d array as [frame, Beams, Samples].
+        """
+        for start in range(0, self.nframe, chunk_size):
+            stop = min(start + chunk_size, self.nframe)
+            yield self.time.iloc[start:stop], self._read(slice(start, stop))
+
+    def close(self):
+        """
+        Release the file
+        """
+        self._frames = None
+
+    def _search(self, time, side):
+        """
+        Find the position where time would be inserted to keep frames ordered
+        """
+        return int(self.time.searchsorted(_utc_naive(time), side=side))
+
+    def _read(self, key):
+        """
+        Read frames as [Beams, Samples] arrays
+        """
+        if self._frames is None:
+            raise ValueError("I/O operation on closed file.")
+
+        samples = self._frames['samples'][key]
+        samples = samples.reshape(samples.shape[:-1] + (self.num_samples, self.num_beams))
+        return np.ascontiguousarray(np.swapaxes(samples, -1, -2))
+
+
+def _is_position(key):
+    """
+    Check if a key is a position (int) instead of a timestamp
+    """
+    return key is None or isinstance(key, (int, np.integer))
+
+
+def _try_read_ddf_info(urlfile, sample):
+    """
+    Read headers of ddf v3 file, return None if it fails
+    """
+    try:
+        return _read_ddf_info(urlfile, sample)
+    except RuntimeError:
+        return None
+
+
+def didson_info(source, output='DIDSON_info.csv', sample=None, jobs=1):
     """
     Get information from DIDSON file
 
     Include file timestamp, duration, fps, number of beams and samples,
     window start (distance from DIDSON to first sample) and window length
-    (distance from first sample to the last).
+    (distance from first sample to the last). PC times (PCtimeFrom and
+    PCtimeTo) and sonar times are in UTC. Versions up to 1.4 wrote the PC times
+    in the local time zone, so do not append new files to a csv file created
+    by these versions.
 
     Parameters
     ----------
@@ -209,6 +660,14 @@ def didson_info(source, output='DIDSON_info.csv'):
         match multiple files (use \*)
     output : str, default 'DIDSON_info.csv'
         Name of the csv file to save video information
+    sample : int, default None
+        Read only the headers of this number of frames, evenly spaced in the file
+        (always including the first and last frames), to get the window start and
+        length faster. Default will read all frames. For URLs, only the headers are
+        downloaded, using HTTP Range requests if supported by the server.
+    jobs : int, default 1
+        Number of files to read concurrently. Rows are still written in the
+        same order as the input files.
     """
     df, has_group, _ = parse_file_path(source)
 
@@ -222,25 +681,30 @@ def didson_info(source, output='DIDSON_info.csv'):
 
     file_out = Path(output)
     if file_out.exists():
-        with open(file_out, encoding="utf-8") as f:
-            count = sum(1 for _ in f)
-        count -= 1
-        df = df.loc[count:]
+        done = pd.read_csv(file_out, usecols=['filename'])['filename']
+        df = df[~df['filename'].isin(done)]
         f = open(file_out, "a", encoding="utf-8")
-        print(f"{output} already exists! {count} files already processed,"
+        print(f"{output} already exists! {done.shape[0]} files already processed,"
             "skipping to remaining files.")
     else:
         f = open(file_out, "w", encoding="utf-8")
         f.write(header)
 
-    for _, row in tqdm(df.iterrows(), total=df.shape[0]):
+    read_info = partial(_try_read_ddf_info, sample=sample)
+    if jobs > 1:
+        infos = prefetch(read_info, df['urlfile'], jobs)
+    else:
+        infos = map(read_info, df['urlfile'])
+
+    # rows are written in input order, as soon as each file is read
+    for (_, row), info in tqdm(zip(df.iterrows(), infos), total=df.shape[0]):
 
         to_write = f"{row['group']},{row['filename']}" if has_group else row['filename']
 
-        try:
-            info = _read_ddf_info(row['urlfile'])
-            f.write(f'{to_write},{info}\n')
-        except RuntimeError:
+        if info is None:
             f.write(f'{to_write}{seps}\n')
+        else:
+            f.write(f'{to_write},{info}\n')
+        f.flush()
 
     f.close()
@@ -0,0 +1,113 @@
+"""Functions to convert DIDSON files to HDF5 and read them"""
+import numpy as np
+import pandas as pd
+from ._utils import import_h5py
+from ._iterate_ffmpeg import iterate_ffmpeg
+from .didson_file import DidsonFile
+
+
+def _run_convert(input_file, output_file, skip, params, f, subfolder, video_name):
+    """
+    Write frames and per-frame metadata of a DIDSON file to a HDF5 file
+    """
+    h5py = params['h5py']
+    output_file = output_file.with_suffix('.h5')
+    chunk = params['chunk_size']
+
+    with DidsonFile(str(input_file)) as ddf, h5py.File(output_file, 'w') as store:
+        store.attrs['original_file'] = video_name
+        store.attrs['framerate'] = ddf.framerate
+        store.attrs['resolution'] = ddf.resolution
+        store.attrs['num_beams'] = ddf.num_beams
+        store.attrs['num_samples'] = ddf.num_samples
+
+        # resizable along frames, so files without frames still have a valid chunk shape
+        frames = store.create_dataset('frames', shape=(len(ddf), ddf.num_beams, ddf.num_samples),
+            maxshape=(None, ddf.num_beams, ddf.num_samples),
+            chunks=(min(chunk, max(len(ddf), 1)), ddf.num_beams, ddf.num_samples),
+            dtype=np.uint8, compression='gzip', compression_opts=params['level'], shuffle=True)
+
+        # time index, as ns since epoch, used to find the chunks of a time window
+        store.create_dataset('time', data=ddf.time.values.astype('datetime64[ns]').astype(np.int64))
+        store.create_dataset('pctime', data=ddf.pctime.values.astype('datetime64[ns]').astype(np.int64))
+        store.create_dataset('window_start', data=ddf.window_start)
+        store.create_dataset('window_length', data=ddf.window_length)
+
+        # write one HDF5 chunk at a time
+        for start in range(0, len(ddf), chunk):
+            stop = min(start + chunk, len(ddf))
+            frames[start:stop] = ddf[start:stop]
+
+        nframe = len(ddf)
+
+    f.write(f"{subfolder}{output_file.name},{video_name},{nframe}\n")
+
+
+def didson_convert(source, output='DIDSON_h5', chunk_size=64, level=4):
+    """
+    Convert DIDSON files to HDF5
+
+    Each DIDSON file is saved as a HDF5 file with the samples compressed in
+    chunks of frames (gzip with shuffle filter), so reading a time window only
+    decompresses the matching chunks. The HDF5 file has the datasets:
+    'frames' [frame, Beams, Samples], 'time' (sonar time), 'pctime' (PC time),
+    as ns since epoch, 'window_start' and 'window_length' (in meters), and
+    the attributes 'framerate', 'resolution', 'num_beams', 'num_samples'
+    and 'original_file'. Use read_didson_h5 to read them. Requires h5py.
+
+    Parameters
+    ----------
+    source : str or pandas.DataFrame
+        A pandas DataFrame, a path to .csv file, or a Glob pattern to
+        match multiple files (use \\*)
+    output : str, default 'DIDSON_h5'
+        Name of the output folder to save the HDF5 files.
+    chunk_size : int, default 64
+        Number of frames in each compressed chunk. Smaller chunks make reading
+        short time windows faster, larger chunks compress a bit better.
+    level : int, default 4
+        gzip compression level, from 0 to 9.
+    """
+    h5py = import_h5py()
+
+    header = 'filename,original_video,frames\n'
+
+    params = {'h5py': h5py,
+        'chunk_size': chunk_size,
+        'level': level
+    }
+
+    iterate_ffmpeg(source, output, header, False, _run_convert, params)
+
+
+def read_didson_h5(h5file, time_from=None, time_to=None):
+    """
+    Get data from a DIDSON file converted to HDF5
+
+    Parameters
+    ----------
+    h5file : str
+        Path to a HDF5 file created by didson_convert.
+    time_from : str, datetime or pandas.Timestamp, default None
+        Read frames from this time (inclusive). Default is the first frame.
+    time_to : str, datetime or pandas.Timestamp, default None
+        Read frames up to this time (inclusive). Default is the last frame.
+
+    Returns
+    -------
+    pandas.Series
+        The timestamp for each frame.
+
+    numpy.array
+        A 3d array as [frame, Beams, Samples].
+    """
+    h5py = import_h5py()
+
+    with h5py.File(h5file, 'r') as store:
+        time = store['time'][:]
+        start = 0 if time_from is None else np.searchsorted(time, pd.Timestamp(time_from).value, 'left')
+        stop = len(time) if time_to is None else np.searchsorted(time, pd.Timestamp(time_to).value, 'right')
+
+        frames = store['frames'][start:stop]
+
+    return pd.Series(pd.to_datetime(time[start:stop])), frames
@@ -0,0 +1,121 @@
+"""Functions to summarize DIDSON files as images"""
+import numpy as np
+import cv2
+from ._iterate_ffmpeg import iterate_ffmpeg
+from .didson_file import DidsonFile
+from .didson_video import fan_image
+
+
+def _range_bins(ws, wl, num_samples, extent, bins):
+    """
+    Index of the range bin of each sample, for frames with window
+    start ws and window length wl
+    """
+    r_min, r_max = extent
+    r = ws[:, None] + (np.arange(num_samples) + 0.5) * (wl[:, None] / num_samples)
+    index = ((r - r_min) / (r_max - r_min) * bins).astype(np.int64)
+    return np.clip(index, 0, bins - 1)
+
+
+def _run_summary(input_file, output_file, skip, params, f, subfolder, video_name):
+    """
+    Compute mean and max images, echogram and empty frames of a DIDSON file
+    in one pass over the frames, and save them as images
+    """
+    bins = params['bins']
+    name = output_file.stem
+
+    with DidsonFile(str(input_file)) as ddf:
+        nframe = len(ddf)
+        if nframe == 0:
+            with open("log_download.txt", 'a', encoding="utf-8") as ferr:
+                ferr.write(f"No frame in DIDSON file: {video_name}\n")
+            # still listed in the csv, without statistics
+            f.write(f"{subfolder}{name},{video_name},0,,,,,\n")
+            return
+
+        extent = (float(ddf.window_start.min()),
+            float((ddf.window_start + ddf.window_length).max()))
+
+        total = np.zeros((ddf.num_beams, ddf.num_samples), dtype=np.uint64)
+        maximum = np.zeros((ddf.num_beams, ddf.num_samples), dtype=np.uint8)
+        echogram = np.zeros((nframe, bins))
+        nempty = 0
+
+        for start in range(0, nframe, params['chunk_size']):
+            stop = min(start + params['chunk_size'], nframe)
+            frames = ddf[start:stop]
+
+            total += frames.sum(axis=0, dtype=np.uint64)
+            np.maximum(maximum, frames.max(axis=0), out=maximum)
+            nempty += int((frames.max(axis=(1, 2)) <= params['threshold']).sum())
+
+            # mean intensity across beams, averaged in each range bin
+            profile = frames.mean(axis=1)
+            index = _range_bins(ddf.window_start[start:stop], ddf.window_length[start:stop],
+                ddf.num_samples, extent, bins)
+            index += np.arange(stop - start)[:, None] * bins
+            sums = np.bincount(index.ravel(), profile.ravel(), (stop - start) * bins)
+            counts = np.bincount(index.ravel(), minlength=(stop - start) * bins)
+            echogram[start:stop] = np.divide(sums, counts, out=np.zeros_like(sums),
+                where=counts > 0).reshape(-1, bins)
+
+        mean = total / nframe
+
+        # mean and max are rendered with the most common window in the file
+        windows, counts = np.unique(np.stack([ddf.window_start, ddf.window_length]),
+            axis=1, return_counts=True)
+        ws, wl = windows[:, counts.argmax()]
+
+    outfolder = output_file.parent
+    cv2.imwrite(str(outfolder / f"{name}_mean.png"),
+        fan_image(mean.round().astype(np.uint8), ws, wl, params['width']))
+    cv2.imwrite(str(outfolder / f"{name}_max.png"), fan_image(maximum, ws, wl, params['width']))
+
+    # range in rows (near range on top) and frames in columns
+    cv2.imwrite(str(outfolder / f"{name}_echogram.png"), echogram.T.round().astype(np.uint8))
+
+    f.write(f"{subfolder}{name},{video_name},{nframe},{nempty / nframe:.4f},"
+        f"{mean.mean():.2f},{maximum.max()},{extent[0]:g},{extent[1]:g}\n")
+
+
+def didson_summary(source, output='DIDSON_summary', bins=128, threshold=0, width=400):
+    """
+    Summarize DIDSON files as images
+
+    For each file, the frames are read once, in chunks, to compute the mean
+    and the maximum echo intensity of each sample, an echogram (mean intensity
+    of all beams in each range bin, for each frame) and the number of empty
+    frames. The mean and max images are saved as fan images (using the most
+    common window of the file), the echogram is saved with range in rows
+    (near range on top) and frames in columns. A csv file lists, for each
+    file, the number of frames, the fraction of empty frames, the mean and max
+    intensity, and the range (minimum window start and maximum window end,
+    in meters) covered by the echogram. Files without frames are listed with
+    0 frames and empty values, and no images are saved.
+
+    Parameters
+    ----------
+    source : str or pandas.DataFrame
+        A pandas DataFrame, a path to .csv file, or a Glob pattern to
+        match multiple files (use \\*)
+    output : str, default 'DIDSON_summary'
+        Name of the output folder to save the images and the csv file.
+    bins : int, default 128
+        Number of range bins in the echogram.
+    threshold : int, default 0
+        Frames without any sample above this intensity are considered empty.
+        Increase it to ignore the background noise.
+    width : int, default 400
+        Width of the mean and max images, in pixels.
+    """
+    header = ('filename,original_video,frames,empty_fraction,mean_intensity,'
+        'max_intensity,range_from,range_to\n')
+
+    params = {'bins': bins,
+        'threshold': threshold,
+        'width': width,
+        'chunk_size': 100
+    }
+
+    iterate_ffmpeg(source, output, header, False, _run_summary, params)
@@ -0,0 +1,179 @@
+"""Functions to render DIDSON frames as fan images and videos"""
+from math import ceil
+from functools import lru_cache
+import numpy as np
+import cv2
+from ._utils import open_ffmpeg_writer, close_ffmpeg_writer
+from ._iterate_ffmpeg import iterate_ffmpeg
+from .didson_file import DidsonFile
+
+# field of view of DIDSON 3000, in degrees (same for HF and LF)
+FOV = 28.8
+
+# video FPS used when the frame rate is missing in the file and in the frame times
+DEFAULT_FPS = 10
+
+
+@lru_cache(maxsize=32)
+def _fan_maps(num_beams, num_samples, window_start, window_length, extent, width, fov):
+    """
+    Compute the lookup table used by cv2.remap to convert a frame of
+    [Beams, Samples] to the fan image. The sonar is at the bottom center
+    of the image and beam 0 is on the right side.
+    Return the maps of x (sample) and y (beam) coordinates
+    """
+    r_min, r_max = extent
+    half = np.deg2rad(fov) / 2
+    scale = 2 * r_max * np.sin(half) / width # meters per pixel
+    height = ceil((r_max - r_min * np.cos(half)) / scale)
+
+    x = (np.arange(width) + 0.5 - width / 2) * scale
+    y = r_max - (np.arange(height) + 0.5) * scale
+    x, y = np.meshgrid(x, y)
+
+    r = np.hypot(x, y)
+    theta = np.arctan2(x, y)
+
+    sample = (r - window_start) / window_length * num_samples - 0.5
+    beam = (half - theta) / (2 * half) * num_beams - 0.5
+
+    # pixels outside the fan are mapped to the border (black)
+    inside = (r >= window_start) & (r <= window_start + window_length) & (np.abs(theta) <= half)
+    sample = np.where(inside, np.clip(sample, 0, num_samples - 1), -1).astype(np.float32)
+    beam = np.where(inside, np.clip(beam, 0, num_beams - 1), -1).astype(np.float32)
+
+    return sample, beam
+
+
+def fan_image(frame, window_start, window_length, width=800, extent=None, fov=FOV):
+    """
+    Convert a DIDSON frame to a fan-shaped image
+
+    Parameters
+    ----------
+    frame : numpy.array
+        A 2d array as [Beams, Samples], as returned by read_ddf or DidsonFile.
+    window_start : float
+        Distance from DIDSON to first sample, in meters.
+    window_length : float
+        Distance from first sample to the last, in meters.
+    width : int, default 800
+        Width of the image, in pixels. The height is set to keep the aspect ratio.
+    extent : tuple of float, default None
+        Minimum and maximum range (in meters) covered by the image, to render
+        frames with different windows at the same scale. Default is the
+        window of the frame.
+    fov : float, default 28.8
+        Field of view of the sonar, in degrees.
+
+    Returns
+    -------
+    numpy.array
+        The fan image (grayscale), with the sonar at the bottom center.
+    """
+    if extent is None:
+        extent = (window_start, window_start + window_length)
+
+    map1, map2 = _fan_maps(frame.shape[0], frame.shape[1], float(window_start),
+        float(window_length), (float(extent[0]), float(extent[1])), width, fov)
+
+    return cv2.remap(np.ascontiguousarray(frame), map1, map2, cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+
+
+def _framerate(ddf):
+    """
+    Frame rate recorded in the DIDSON file. If it is missing (0), it is
+    estimated from the median interval between frame times
+    """
+    if ddf.framerate > 0:
+        return ddf.framerate
+
+    step = ddf.time.diff().median().total_seconds()
+    return 1 / step if step > 0 else DEFAULT_FPS
+
+
+def _ffmpeg_run_didson(input_file, output_file, skip, params, f, subfolder, video_name):
+    """
+    Render frames of a DIDSON file and encode them to mp4
+    """
+    output_file = output_file.with_suffix('.mp4')
+
+    with DidsonFile(str(input_file)) as ddf:
+        if len(ddf) == 0:
+            with open("log_download.txt", 'a', encoding="utf-8") as ferr:
+                ferr.write(f"No frame in DIDSON file: {video_name}\n")
+            return
+
+        # same scale for all frames, even if the window changes
+        extent = (float(ddf.window_start.min()),
+            float((ddf.window_start + ddf.window_length).max()))
+        width = params['width']
+        height = _fan_maps(ddf.num_beams, ddf.num_samples, float(ddf.window_start[0]),
+            float(ddf.window_length[0]), extent, width, params['fov'])[0].shape[0]
+
+        fps = _framerate(ddf) if params['fps'] is None else params['fps']
+        proc = open_ffmpeg_writer(output_file, width, height, fps, params['crf'],
+            params['preset'], params['h265'], pix_fmt='gray')
+
+        try:
+            for start in range(0, len(ddf), params['chunk_size']):
+                stop = min(start + params['chunk_size'], len(ddf))
+                frames = ddf[start:stop]
+                for frame, ws, wl in zip(frames, ddf.window_start[start:stop],
+                    ddf.window_length[start:stop]):
+                    img = fan_image(frame, ws, wl, width, extent, params['fov'])
+                    proc.stdin.write(img.tobytes())
+        finally:
+            close_ffmpeg_writer(proc)
+
+    f.write(f"{subfolder}{output_file.name},{video_name},{len(ddf)},{width}x{height}\n")
+
+
+def didson_video(source, output='DIDSON_video', width=800, fps=None, crf=None,
+    preset='medium', h265=False, fov=FOV):
+    """
+    Render DIDSON files as videos
+
+    Frames are converted from [Beams, Samples] to the fan-shaped image seen by
+    the sonar, with the sonar at the bottom center, and encoded to mp4. The
+    conversion uses a lookup table (cv2.remap) computed once for each window
+    start and window length in the file. All frames of a file are rendered at
+    the same scale, covering the range of all windows in the file.
+
+    Parameters
+    ----------
+    source : str or pandas.DataFrame
+        A pandas DataFrame, a path to .csv file, or a Glob pattern to
+        match multiple files (use \\*)
+    output : str, default 'DIDSON_video'
+        Name of the output folder to save the videos.
+    width : int, default 800
+        Width of the video, in pixels. The height is set to keep the aspect ratio.
+    fps : float, default None
+        Video FPS. Default is the frame rate recorded in the DIDSON file. If
+        it is missing (0), the frame rate is estimated from the frame times,
+        or 10 if that is not possible.
+    crf : int, default None
+        Set CRF (quality level) in ffmpeg. The default will use the
+        default value from ffmpeg.
+    preset : str, default 'medium'
+        Encoding preset in ffmpeg (e.g. 'fast', 'medium', 'slow').
+    h265 : bool, default False
+        Use H.265 encoding instead of H.264. H.265 offers a higher
+        compression, but may not be supported by some players/browsers.
+    fov : float, default 28.8
+        Field of view of the sonar, in degrees.
+    """
+    header = 'filename,original_video,frames,resolution\n'
+
+    params = {'width': width,
+        'fps': fps,
+        'crf': crf,
+        'preset': preset,
+        'h265': h265,
+        'fov': fov,
+        'chunk_size': 100
+    }
+
+    iterate_ffmpeg(source, output, header, False, _ffmpeg_run_didson, params)
@@ -1,15 +1,37 @@
 """Function to extract frames from videos"""
 
 from pathlib import Path
+from contextlib import closing
 import tempfile
 from tqdm.auto import tqdm
 import numpy as np
 import pandas as pd
 import cv2
-from ._utils import download_file, to_timedelta, strftd2, parse_file_path, run_ffmpeg
+from ._utils import (download_file, to_timedelta, strftd2, parse_file_path, run_ffmpeg,
+    video_size, pipe_frames, import_h5py, trim_group, prefetch, filter_path, read_metadata,
+    DuplicateIndex)
 from .utils import name_to_timestamp
 from ._iterate_ffmpeg import iterate_ffmpeg, iterate_init
 
+def _read_scene(meta_file, params):
+    """
+    Read scene scores of the selected frames and set
+    the reason why each frame was kept
+    """
+    if not meta_file.exists():
+        raise RuntimeError(f"ffmpeg did not write the scene scores: {meta_file.name}")
+
+    meta = read_metadata(meta_file)
+    meta_file.unlink()
+
+    meta['scene_score'] = meta['lavfi.scene_score'].astype(float).round(4)
+    meta['reason'] = 'interval'
+    meta.loc[meta['scene_score'] > params['scene_threshold'], 'reason'] = 'scene'
+    meta.loc[0, 'reason'] = 'first'
+
+    return meta[['pts_time', 'reason', 'scene_score']]
+
+
 def _ffmpeg_run_frame(input_file, output_file, skip, params, f, subfolder, video_name):
     """
     Create ffmpeg command and run and 
@@ -20,8 +42,13 @@ def _ffmpeg_run_frame(input_file, output_file, skip, params, f, subfolder, video
     outfolder = output_file.parent
     output_file = f"{outfolder / file_name}_%05d.jpg"
 
+    vf_cmd = params['vf']
+    if params['scene_threshold'] is not None:
+        meta_file = outfolder / f"{file_name}_metadata.txt"
+        vf_cmd = vf_cmd + f",metadata=mode=print:file={filter_path(meta_file)}"
+
     # Create ffmpeg command and run
-    ff_cmd = ['ffmpeg'] + skip + ['-i', input_file] + params['ffmpeg'] + [output_file]
+    ff_cmd = ['ffmpeg'] + skip + ['-i', input_file, '-vf', vf_cmd] + params['ffmpeg'] + [output_file]
     run_ffmpeg(ff_cmd, filename=file_name)
 
     # rename frames to correct timestamp
@@ -35,30 +62,239 @@ def _ffmpeg_run_frame(input_file, output_file, skip, params, f, subfolder, video
             dout['timestamp'] = dout['timestamp'].str.split('-').str[0]
 
         dout['timestamp'] = pd.to_datetime(dout['timestamp'], format='%Y%m%dT%H%M%S.%fZ', utc=True)
-        dout['timeadd'] = (dout['filename_split'].str[-1].astype(float) *
-            params['interval'] - params['interval2'])
+        if params['scene_threshold'] is None:
+            dout['timeadd'] = (dout['filename_split'].str[-1].astype(float) *
+                params['interval'] - params['interval2'])
+        else:
+            meta = _read_scene(meta_file, params)
+            meta = meta.iloc[dout['filename_split'].str[-1].astype(int) - 1]
+            dout['timeadd'] = meta['pts_time'].values
+            dout['reason'] = meta['reason'].values
+            dout['scene_score'] = meta['scene_score'].values
         dout['timestamp'] = dout['timestamp'] + pd.to_timedelta(dout['timeadd'], unit='sec')
         dout['filename'] = (dout['filename_split'].str[:-2].str.join('_') + '_' +
             dout['timestamp'].dt.strftime('%Y%m%dT%H%M%S.%f').str[:-3] + 'Z.jpg')
 
-        for _, row2 in dout.iterrows():
-            row2['filename_old'].rename(row2['filename_old'].with_name(row2['filename']))
+        dout = dout.sort_values('timestamp')
+        dout['duplicate_of'] = None
+
+        for i, row2 in dout.iterrows():
+            new_file = row2['filename_old'].rename(row2['filename_old'].with_name(row2['filename']))
+
+            # remove near-duplicates of recent frames
+            if params['dedupe'] is not None:
+                index = params['dedupe_index'].setdefault(subfolder, DuplicateIndex(params['dedupe']))
+                img = cv2.imread(str(new_file), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+                dout.at[i, 'duplicate_of'] = index.check(img, row2['filename'])
+                if dout.at[i, 'duplicate_of'] is not None:
+                    new_file.unlink()
 
         # save csv with all frames names + original videos
+        columns = ['filename', 'original_video', 'timestamp']
+        if params['scene_threshold'] is not None:
+            columns = columns + ['reason', 'scene_score']
+        if params['dedupe'] is not None:
+            columns = columns + ['duplicate_of']
+
         if subfolder != '':
             dout['subfolder'] = subfolder[:-1]
-            dout = dout[['subfolder', 'filename', 'original_video', 'timestamp']]
-        else:
-            dout = dout[['filename', 'original_video', 'timestamp']]
+            columns = ['subfolder'] + columns
 
+        dout = dout[columns]
         dout.to_csv(f, mode='a', index=False, header=False, lineterminator='\n')
     else:
+        if params['scene_threshold'] is not None:
+            meta_file.unlink(missing_ok=True)
         with open("log_download.txt", 'a', encoding="utf-8") as ferr:
             ferr.write(f"No frame was extracted from: {input_file.name}\n")
 
 
+def _append_store(dataset, data):
+    """
+    Append data in the first axis of a resizable HDF5 dataset
+    """
+    n = dataset.shape[0]
+    dataset.resize(n + len(data), axis=0)
+    dataset[n:] = data
+
+
+def _truncate_store(store, csv_file):
+    """
+    Remove frames of videos that were not completely processed, so
+    the store matches the rows in the csv file when resuming
+    """
+    if csv_file.exists():
+        tmp = pd.read_csv(csv_file)
+        if 'duplicate_of' in tmp:
+            tmp = tmp[tmp['duplicate_of'].isnull()]
+        if 'subfolder' in tmp:
+            counts = tmp['subfolder'].astype(str).value_counts().to_dict()
+        else:
+            counts = {'/': tmp.shape[0]}
+    else:
+        counts = {}
+
+    def _truncate(name, obj):
+        if name.split('/')[-1] == 'frames':
+            group = obj.parent
+            count = counts.get(group.name.strip('/') or '/', 0)
+            for dataset in ('frames', 'timestamp'):
+                if group[dataset].shape[0] > count:
+                    group[dataset].resize(count, axis=0)
+
+    store.visititems(_truncate)
+
+
+def _ffmpeg_run_store(input_file, output_file, skip, params, f, subfolder, video_name):
+    """
+    Create ffmpeg command that pipe frames to a HDF5 store and
+    write in a csv file for the generated frames
+    """
+    store = params['store']
+    group = store.require_group(subfolder[:-1]) if subfolder != '' else store
+
+    # all frames in a group must have the same size
+    vf_cmd = params['vf']
+    if 'frames' in group:
+        height, width = group['frames'].shape[1:3]
+        vf_cmd = vf_cmd + f',scale={width}:{height}'
+    elif params['resize'] is not None:
+        width, height = params['resize']
+        vf_cmd = vf_cmd + f',scale={width}:{height}'
+    else:
+        width, height = video_size(input_file)
+
+    if 'frames' not in group:
+        group.create_dataset('frames', shape=(0, height, width, 3),
+            maxshape=(None, height, width, 3), chunks=(1, height, width, 3),
+            dtype=np.uint8, compression='gzip', shuffle=True)
+        group.create_dataset('timestamp', shape=(0,), maxshape=(None,), dtype=np.int64)
+
+    index0 = group['frames'].shape[0]
+
+    if params['scene_threshold'] is not None:
+        meta_file = Path(tempfile.gettempdir()) / f"{output_file.stem}_metadata.txt"
+        vf_cmd = vf_cmd + f",metadata=mode=print:file={filter_path(meta_file)}"
+
+    # scene selection drops frames, so timestamps must be kept (requires ffmpeg >= 5.1)
+    vfr = [] if params['scene_threshold'] is None else ['-fps_mode', 'vfr']
+
+    ff_cmd = ['ffmpeg', '-v', 'error'] + skip + ['-i', input_file, '-vf', vf_cmd
+        ] + vfr + ['-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:']
+
+    if params['dedupe'] is not None:
+        dup_index = params['dedupe_index'].setdefault(subfolder, DuplicateIndex(params['dedupe']))
+
+    batch = []
+    nsaved = 0
+    duplicate_of = []
+    for frame in pipe_frames(ff_cmd, width, height):
+
+        # skip near-duplicates of recent frames
+        if params['dedupe'] is not None:
+            duplicate_of.append(dup_index.check(frame, index0 + nsaved + len(batch)))
+            if duplicate_of[-1] is not None:
+                continue
+        else:
+            duplicate_of.append(None)
+
+        batch.append(frame)
+        if len(batch) == params['batch_size']:
+            _append_store(group['frames'], np.stack(batch))
+            nsaved += len(batch)
+            batch = []
+
+    if len(batch) > 0:
+        _append_store(group['frames'], np.stack(batch))
+        nsaved += len(batch)
+
+    nframes = len(duplicate_of)
+    if params['scene_threshold'] is not None:
+        if nframes == 0:
+            meta_file.unlink(missing_ok=True)
+        else:
+            meta = _read_scene(meta_file, params)
+            if len(meta) < nframes:
+                raise RuntimeError(f"ffmpeg did not write the scene scores of all frames: {video_name}")
+
+    if nframes > 0:
+        timestamp = name_to_timestamp(output_file.name)
+        if params['scene_threshold'] is None:
+            timeadd = np.arange(1, nframes + 1) * params['interval'] - params['interval2']
+        else:
+            meta = meta.iloc[:nframes]
+            timeadd = meta['pts_time'].values
+        timestamp = timestamp + pd.to_timedelta(timeadd, unit='sec')
+
+        dout = pd.DataFrame({'index': pd.NA, 'original_video': video_name,
+            'timestamp': timestamp, 'duplicate_of': pd.array(duplicate_of, dtype='Int64')})
+        saved = dout['duplicate_of'].isnull()
+        dout['index'] = dout['index'].astype('Int64')
+        dout.loc[saved, 'index'] = range(index0, index0 + nsaved)
+
+        _append_store(group['timestamp'], timestamp[saved.values].as_unit('ns').asi8)
+
+        if params['scene_threshold'] is not None:
+            dout['reason'] = meta['reason'].values
+            dout['scene_score'] = meta['scene_score'].values
+
+        if params['dedupe'] is None:
+            dout = dout.drop(columns='duplicate_of')
+        else:
+            dout['duplicate_of'] = dout.pop('duplicate_of')
+
+        if subfolder != '':
+            dout.insert(0, 'subfolder', subfolder[:-1])
+
+        dout.to_csv(f, mode='a', index=False, header=False, lineterminator='\n')
+        store.flush()
+    else:
+        with open("log_download.txt", 'a', encoding="utf-8") as ferr:
+            ferr.write(f"No frame was extracted from: {Path(input_file).name}\n")
+
+
+def _fps_filter(interval, deinterlace, rounding_near):
+    """
+    Create the fps filter to extract frames at a given interval.
+    Also return the time to subtract from i * interval to get
+    the time of the i-th frame
+    """
+    if interval < 1.0:
+        vf_cmd = f'fps={1/interval}'
+    elif interval == 1.0:
+        vf_cmd = 'fps=1'
+    else:
+        vf_cmd = f'fps=1/{interval}'
+
+    if deinterlace:
+        vf_cmd = 'pp=ci|a,' + vf_cmd
+
+    if rounding_near:
+        interval2 = interval / 2
+    else:
+        vf_cmd = vf_cmd + ':round=up'
+        interval2 = interval
+
+    return vf_cmd, interval2
+
+
+def _scene_filter(interval, deinterlace, scene_threshold, scene_min_interval):
+    """
+    Create the select filter to extract frames when the scene changes,
+    and at least one frame at every interval
+    """
+    vf_cmd = (f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{interval})"
+        f"+gt(scene,{scene_threshold})*gte(t-prev_selected_t,{scene_min_interval})'")
+
+    if deinterlace:
+        vf_cmd = 'pp=ci|a,' + vf_cmd
+
+    return vf_cmd
+
+
 def extract_frame(source, interval, output='frames', trim=False,
-    deinterlace=False, rounding_near=False):
+    deinterlace=False, rounding_near=False, output_format='jpg', resize=None,
+    scene_threshold=None, scene_min_interval=1, dedupe=None):
     """
     Extract frames at a given interval
 
@@ -79,35 +315,183 @@ def extract_frame(source, interval, output='frames', trim=False,
     rounding_near : bool, default False
         Grab frames at the middle of each interval (default ffmpeg
         behavior). If False, will grab frames at the start of each interval.
+    output_format : {'jpg', 'hdf5'}, default 'jpg'
+        If 'jpg', each frame is saved as a jpg image. If 'hdf5', frames are
+        saved in a compressed HDF5 file inside the output folder, with one
+        group for each subfolder containing the datasets 'frames' (uint8 array
+        as [frame, height, width, BGR]) and 'timestamp' (nanoseconds since epoch, UTC).
+        The csv file will list the index of each frame in the dataset. Requires h5py.
+    resize : tuple of 2 ints, default None
+        Resize frames to (width, height) before saving. Only used if
+        output_format='hdf5'. If None, frames in a group will have the
+        same size of the first video in the group.
+    scene_threshold : float, default None
+        If provided, frames are sampled adaptively: a frame is extracted
+        whenever the scene score (between 0 and 1) from ffmpeg is above
+        this threshold, and 'interval' becomes the maximum time between
+        two extracted frames. The csv file will include the reason why
+        each frame was kept ('first', 'scene' or 'interval') and the scene score.
+        A value between 0.1 and 0.4 is usually a good start. Requires ffmpeg 5.1 or newer.
+    scene_min_interval : float, default 1
+        Minimum time, in seconds, between frames extracted due to a
+        scene change. Only used if scene_threshold is provided.
+    dedupe : int, default None
+        If provided, frames that are near-duplicates of one of the last 10 frames saved
+        in the same subfolder are not saved. Two frames are near-duplicates if the Hamming
+        distance between their perceptual hashes (dHash, 64 bits) is lower or equal to this
+        value. The csv file will include the column 'duplicate_of' with the filename (or
+        index, if output_format='hdf5') of the frame it duplicates. A value of 5 is a good start.
     """
-    header = 'filename,original_video,timestamp\n'
+    if output_format not in ('jpg', 'hdf5'):
+        raise ValueError("'output_format' must be either 'jpg' or 'hdf5'")
 
-    if interval < 1.0:
-        vf_cmd = f'fps={1/interval}'
-    elif interval == 1.0:
-        vf_cmd = 'fps=1'
-    else:
-        vf_cmd = f'fps=1/{interval}'
+    header = 'filename,original_video,timestamp'
 
-    if deinterlace:
-        vf_cmd = 'pp=ci|a,' + vf_cmd
-
-    if rounding_near:
-        interval2 = interval / 2
+    if scene_threshold is None:
+        vf_cmd, interval2 = _fps_filter(interval, deinterlace, rounding_near)
+        ffmpeg_cmd = []
     else:
-        vf_cmd = vf_cmd + ':round=up'
-        interval2 = interval
+        vf_cmd = _scene_filter(interval, deinterlace, scene_threshold, scene_min_interval)
+        interval2 = 0
+        ffmpeg_cmd = ['-fps_mode', 'vfr']
+        header = header + ',reason,scene_score'
+
+    if dedupe is not None:
+        header = header + ',duplicate_of'
 
-    params = {'ffmpeg': ['-vf', vf_cmd,
-            '-qmin', '1', '-q:v', '1'],
+    params = {'ffmpeg': ffmpeg_cmd + ['-qmin', '1', '-q:v', '1'],
+        'vf': vf_cmd,
         'interval': interval,
-        'interval2': interval2
+        'interval2': interval2,
+        'scene_threshold': scene_threshold,
+        'dedupe': dedupe,
+        'dedupe_index': {}
     }
 
-    iterate_ffmpeg(source, output, header, trim, _ffmpeg_run_frame, params)
+    if output_format == 'jpg':
+        iterate_ffmpeg(source, output, header + '\n', trim, _ffmpeg_run_frame, params)
+        return
+
+    h5py = import_h5py()
 
+    folder = Path(output)
+    folder.mkdir(exist_ok=True)
 
-def extract_fov(source, timestamps=None, clip_or_sharpest='sharpest', duration=None, output='fovs', deinterlace=False):
+    params['resize'] = resize
+    params['batch_size'] = 16
+    params['store'] = h5py.File(folder / (folder.name + '.h5'), 'a')
+
+    try:
+        _truncate_store(params['store'], folder / (folder.name + '.csv'))
+        header = header.replace('filename', 'index', 1) + '\n'
+        iterate_ffmpeg(source, output, header, trim, _ffmpeg_run_store, params)
+    finally:
+        params['store'].close()
+
+
+def iter_frames(source, interval, trim=False, deinterlace=False,
+    rounding_near=False, resize=None, prefetch_files=2, dedupe=None):
+    """
+    Iterate over frames at a given interval
+
+    Frames are decoded directly into memory, without writing images to disk.
+    Videos are downloaded in the background while frames of the current video
+    are decoded, and only one frame is kept in memory at a time.
+
+    Parameters
+    ----------
+    source : str or pandas.DataFrame
+        A pandas DataFrame, a path to .csv file, or a Glob pattern to
+        match multiple files (use \*)
+    interval : float
+        Interval, in seconds, to extract frames (e.g. a value of 10 will
+        extract one frame every 10 seconds).
+    trim : bool, default False
+        Trim video files to match the initial search query
+    deinterlace : bool, default False
+        Deinterlace video before getting the frames.
+    rounding_near : bool, default False
+        Grab frames at the middle of each interval (default ffmpeg
+        behavior). If False, will grab frames at the start of each interval.
+    resize : tuple of 2 ints, default None
+        Resize frames to (width, height).
+    prefetch_files : int, default 2
+        Number of videos to download ahead of the video being decoded.
+    dedupe : int, default None
+        If provided, skip frames that are near-duplicates of one of the last 10
+        frames yielded from the same group. Check 'extract_frame' for details.
+
+    Yields
+    ------
+    pandas.Timestamp
+        The timestamp of the frame.
+    str
+        The deviceCode of the camera.
+    numpy.array
+        The frame, as a 3d array [height, width, BGR].
+    """
+    df, has_group, need_download = parse_file_path(source)
+
+    if has_group:
+        df = df.sort_values(['group', 'filename'])
+    else:
+        df = df.sort_values(['filename'])
+        df['group'] = 'group1'
+
+    vf_cmd, interval2 = _fps_filter(interval, deinterlace, rounding_near)
+    if resize is not None:
+        vf_cmd = vf_cmd + f',scale={resize[0]}:{resize[1]}'
+
+    rows = []
+    for _, group in df.groupby('group'):
+        group = group.copy()
+        group['skip'] = [[]] * len(group)
+        if trim:
+            group = trim_group(group)
+        rows.extend(row for _, row in group.iterrows())
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+
+        def _get_file(row):
+            if need_download:
+                tmpfile = Path(tmpdir) / row['filename']
+                if not download_file(row['urlfile'], tmpfile):
+                    return row, None
+                return row, tmpfile
+            return row, row['urlfile']
+
+        with closing(prefetch(_get_file, rows, prefetch_files)) as files:
+            dup_index = {}
+            for row, input_file in files:
+                if input_file is None:
+                    continue
+
+                if resize is None:
+                    width, height = video_size(input_file)
+                else:
+                    width, height = resize
+
+                ff_cmd = ['ffmpeg', '-v', 'error'] + row['skip'] + ['-i', input_file,
+                    '-vf', vf_cmd, '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:']
+
+                timestamp = name_to_timestamp(row['filename'])
+                frames = pipe_frames(ff_cmd, width, height)
+                for i, frame in enumerate(frames, 1):
+                    timeadd = pd.to_timedelta(i * interval - interval2, unit='sec')
+
+                    if dedupe is not None:
+                        index = dup_index.setdefault(row['group'], DuplicateIndex(dedupe))
+                        if index.check(frame, i) is not None:
+                            continue
+
+                    yield timestamp + timeadd, timestamp.dc, frame
+
+                if need_download:
+                    input_file.unlink()
+
+
+def extract_fov(source, timestamps=None, clip_or_sharpest='sharpest', duration=None, output='fovs', deinterlace=False,
+    dedupe=None):
     """
     Extract FOVs from videos
 
@@ -135,6 +519,11 @@ def extract_fov(source, timestamps=None, clip_or_sharpest='sharpest', duration=N
     deinterlace : bool, default False
         Deinterlace video before getting the frames. This argument is ignored
         for clips, since the stream is copied from the original video.
+    dedupe : int, default None
+        If provided, framegrabs that are near-duplicates of one of the last 10 frames
+        saved in the same FOV folder are not saved. The csv file will include one column
+        for each FOV with the filename of the frame it duplicates. Check 'extract_frame'
+        for details. This argument is ignored for clips.
     """
     df, has_group, need_download = parse_file_path(source)
 
@@ -161,7 +550,12 @@ def extract_fov(source, timestamps=None, clip_or_sharpest='sharpest', duration=N
 
     # header for the output csv
 
-    header = f"original_video,{','.join(fovfolder)}\n"
+    header = f"original_video,{','.join(fovfolder)}"
+    if dedupe is not None:
+        header = header + ''.join(f',{fov}_duplicate_of' for fov in fovfolder)
+    header = header + '\n'
+
+    dup_index = {}
 
     df, folder, f = iterate_init(output, header, df, has_group)
 
@@ -224,12 +618,18 @@ def extract_fov(source, timestamps=None, clip_or_sharpest='sharpest', duration=N
 
                 # Extract frame/video for each FOV
                 filename_fovs = []
+                duplicate_of = []
                 for fov, p in zip(row['fovs'], row['subfolder']):
 
                     if fov == '':
                         filename_fovs.append(new_name.name)
+                        duplicate_of.append('')
                         continue
 
+                    if dedupe is not None:
+                        index = dup_index.setdefault((name, p), DuplicateIndex(dedupe))
+                    dup = None
+
                     newtime = (timestamp + fov).strftime('%Y%m%dT%H%M%S.%f')[:-3]
                     filename = f"{oldname_dc}_{newtime}Z{file_name_p.suffix}"
                     new_name_p = Path(filename)
@@ -242,6 +642,12 @@ def extract_fov(source, timestamps=None, clip_or_sharpest='sharpest', duration=N
                             '-qmin', '1', '-q:v', '1', new_name]
                         run_ffmpeg(ff_cmd, filename=new_name.name)
 
+                        if dedupe is not None and new_name.exists():
+                            img = cv2.imread(str(new_name), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+                            dup = index.check(img, new_name.name)
+                            if dup is not None:
+                                new_name.unlink()
+
                     else:
                         new_name = outfolder / p / new_name_p
                         ff_cmd =['ffmpeg', '-ss', fov_str,
@@ -258,14 +664,24 @@ def extract_fov(source, timestamps=None, clip_or_sharpest='sharpest', duration=N
                                 filename = f"{oldname_dc}_{newtime}Z.jpg"
                                 new_name = outfolder / p / Path(filename)
 
-                                cv2.imwrite(str(new_name), sharpest_frame, [cv2.IMWRITE_JPEG_QUALITY, 100])
-                            
+                                if dedupe is not None:
+                                    dup = index.check(sharpest_frame, new_name.name)
+
+                                if dup is None:
+                                    cv2.imwrite(str(new_name), sharpest_frame, [cv2.IMWRITE_JPEG_QUALITY, 100])
+
 
                     filename_fovs.append(new_name.name)
+                    duplicate_of.append('' if dup is None else dup)
 
                 if need_download:
                     tmpfile.unlink()
 
+                # videos with fewer FOVs are padded, so the duplicate_of columns are aligned
+                if dedupe is not None:
+                    npad = len(fovfolder) - len(filename_fovs)
+                    filename_fovs = filename_fovs + [''] * npad + duplicate_of + [''] * npad
+
                 # save csv with video name
                 if has_group:
                     f.write(f"{name},{row['filename']},{','.join(filename_fovs)}\n")
@@ -0,0 +1,102 @@
+"""Function to generate contact sheets from videos"""
+
+import cv2
+from ._utils import run_ffmpeg, strftd, filter_path, read_metadata
+from ._iterate_ffmpeg import iterate_ffmpeg
+from .extract_frame import _fps_filter
+
+
+def _ffmpeg_run_thumbnails(input_file, output_file, skip, params, f, subfolder, video_name):
+    """
+    Create ffmpeg command and run to generate the contact sheets,
+    then write the WebVTT file and the csv file
+    """
+    file_name = output_file.stem
+    outfolder = output_file.parent
+    sheet_file = f"{outfolder / file_name}_%03d.jpg"
+    meta_file = outfolder / f"{file_name}_metadata.txt"
+
+    # print the time of each frame before tiling
+    vf_cmd = (f"{params['vf']},scale={params['width']}:-2,"
+        "metadata=mode=add:key=oncvideo:value=1,"
+        f"metadata=mode=print:file={filter_path(meta_file)},"
+        f"tile={params['columns']}x{params['rows']}")
+
+    ff_cmd = ['ffmpeg'] + skip + ['-i', input_file, '-vf', vf_cmd,
+        '-qmin', '1', '-q:v', '2', sheet_file]
+    run_ffmpeg(ff_cmd, filename=file_name)
+
+    meta = read_metadata(meta_file) if meta_file.exists() else None
+    meta_file.unlink(missing_ok=True)
+
+    if meta is None or len(meta) == 0:
+        with open("log_download.txt", 'a', encoding="utf-8") as ferr:
+            ferr.write(f"No thumbnail was extracted from: {file_name}\n")
+        return
+
+    # size of each tile
+    ntiles = params['columns'] * params['rows']
+    sheet = cv2.imread(sheet_file % 1, cv2.IMREAD_GRAYSCALE)
+    tile_h = sheet.shape[0] // params['rows']
+    tile_w = sheet.shape[1] // params['columns']
+
+    start = meta['pts_time'].tolist()
+    end = start[1:] + [start[-1] + params['interval']]
+
+    vtt_file = outfolder / f"{file_name}.vtt"
+    with open(vtt_file, 'w', encoding="utf-8") as fvtt:
+        fvtt.write("WEBVTT\n")
+        for i, (t0, t1) in enumerate(zip(start, end)):
+            nsheet, pos = divmod(i, ntiles)
+            row, col = divmod(pos, params['columns'])
+            sheet_name = f"{file_name}_{nsheet + 1:03d}.jpg"
+            fvtt.write(f"\n{strftd(t0)} --> {strftd(t1)}\n"
+                f"{sheet_name}#xywh={col * tile_w},{row * tile_h},{tile_w},{tile_h}\n")
+
+    nsheets = (len(start) - 1) // ntiles + 1
+    f.write(f"{subfolder}{vtt_file.name},{video_name},{nsheets},{len(start)}\n")
+
+
+def make_thumbnails(source, interval=10, output='thumbnails', columns=10, rows=10,
+    width=320, trim=False, deinterlace=False):
+    """
+    Generate contact sheets from videos
+
+    Frames at a given interval are resized and tiled in contact sheets (sprites),
+    decoding each video only once. A WebVTT file is also created for each video,
+    with the position of each thumbnail in the contact sheets, which can be used
+    for video previews in web players.
+
+    Parameters
+    ----------
+    source : str or pandas.DataFrame
+        A pandas DataFrame, a path to .csv file, or a Glob pattern to
+        match multiple files (use \\*)
+    interval : float, default 10
+        Interval, in seconds, to get thumbnails.
+    output : str, default 'thumbnails'
+        Name of the output folder to save contact sheets.
+    columns : int, default 10
+        Number of thumbnails in each row of the contact sheet.
+    rows : int, default 10
+        Number of rows in each contact sheet.
+    width : int, default 320
+        Width of each thumbnail, in pixels. The height is set to
+        keep the aspect ratio.
+    trim : bool, default False
+        Trim video files to match the initial search query
+    deinterlace : bool, default False
+        Deinterlace video before getting the thumbnails.
+    """
+    header = 'filename,original_video,sheets,thumbnails\n'
+
+    vf_cmd, _ = _fps_filter(interval, deinterlace, False)
+
+    params = {'vf': vf_cmd,
+        'interval': interval,
+        'columns': columns,
+        'rows': rows,
+        'width': width
+    }
+
+    iterate_ffmpeg(source, output, header, trim, _ffmpeg_run_thumbnails, params)
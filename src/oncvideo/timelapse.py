@@ -1,18 +1,22 @@
 """Function to make time-lapses"""
 
 from pathlib import Path
+from math import ceil
+from functools import lru_cache, partial
+from contextlib import closing
 import copyreg
 import subprocess as sp
 import tempfile
 import json
-from shutil import copyfile
+from shutil import copyfile, rmtree
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm.auto import tqdm
 import numpy as np
 import pandas as pd
 import cv2
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageColor
 from ttf_opensans import opensans
-from ._utils import LOGO, strfdelta
+from ._utils import LOGO, strfdelta, open_ffmpeg_writer, close_ffmpeg_writer, prefetch
 from .utils import name_to_timestamp
 
 
@@ -22,9 +26,98 @@ def _pickle_keypoints(point):
 
 copyreg.pickle(cv2.KeyPoint().__class__, _pickle_keypoints)
 
+# default options (kwargs) of make_timelapse and align_frames
+DEFAULT_KWARGS = dict(
+    # text (make_timelapse)
+    fill = None,
+    anchor = None,
+    spacing = 4,
+    align = 'left',
+    font_weight = 400,
+    # alignment
+    nfeatures = 5000,
+    epsilon = 1e-8, # 1e-5 and 1e-10
+    maxCount = 500, # 1000 - 5000
+    indexParams = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1),
+    searchParams = dict(checks=50),
+    mask = None,
+    ecc_levels = 3,
+    ecc_refine = 10,
+    phase_scale = 0.5,
+    phase_response = 0.5,
+    # number of images decoded ahead
+    prefetch = 4
+)
+
+TRANSFORMS_HEADER = ('filename,a11,a12,a13,a21,a22,a23,'
+                     'h11,h12,h13,h21,h22,h23,h31,h32,h33\n')
+
+
+def _imread(imgfile):
+    """
+    Read an image as BGR, returning the filename as well
+    """
+    return imgfile, cv2.imread(str(imgfile), cv2.IMREAD_COLOR)
+
+
+def _write_playlist(playlist, segments):
+    """
+    Write a HLS playlist with the timelapse segments
+    """
+    target = max(ceil(seg['duration']) for seg in segments)
+
+    with open(playlist, 'w', encoding='utf-8') as fpl:
+        # the playlist is complete when written, it is rewritten when segments are added
+        fpl.write(f"#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-PLAYLIST-TYPE:VOD\n"
+                  f"#EXT-X-TARGETDURATION:{target}\n#EXT-X-MEDIA-SEQUENCE:0\n")
+        for seg in segments:
+            fpl.write(f"#EXTINF:{seg['duration']:.6f},\n{seg['file']}\n")
+        fpl.write("#EXT-X-ENDLIST\n")
+
+
+def _render_text(text, xy, font, anchor, align, spacing, fill):
+    """
+    Render text as an alpha mask, to be blended with numpy images
+    Return the bounding box (left, top, right, bottom), the alpha
+    mask and the text color (BGR)
+    """
+    draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+    left, top, right, bottom = draw.textbbox(xy, text, font=font, anchor=anchor,
+                                             align=align, spacing=spacing)
+
+    mask = Image.new('L', (right - left, bottom - top), 0)
+    ImageDraw.Draw(mask).text((xy[0] - left, xy[1] - top), text, fill=255, font=font,
+                              anchor=anchor, align=align, spacing=spacing)
+    alpha = np.asarray(mask, dtype=np.float32)[..., None] / 255
+
+    # default text color in PIL for RGB images is white
+    color = (255, 255, 255) if fill is None else ImageColor.getrgb(fill) if isinstance(fill, str) else fill
+    color = np.array(color[2::-1], dtype=np.float32)
+
+    return (left, top, right, bottom), alpha, color
+
+
+def _blend_overlay(img, overlay):
+    """
+    Alpha blend a text rendered with _render_text into the image, in place
+    """
+    (left, top, right, bottom), alpha, color = overlay
+
+    # clip overlay to the image borders
+    x0, y0 = max(left, 0), max(top, 0)
+    x1, y1 = min(right, img.shape[1]), min(bottom, img.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    alpha = alpha[y0 - top:y1 - top, x0 - left:x1 - left]
+    roi = img[y0:y1, x0:x1]
+    roi[:] = roi * (1 - alpha) + color * alpha + 0.5
+
 
 def make_timelapse(folder='fovs', time_display='elapsed', time_format=None, time_offset=0, fps=10,
-    font_size=44, logo=False, caption=None, time_xy=None, caption_xy=None, **kwargs):
+    font_size=44, logo=False, caption=None, time_xy=None, caption_xy=None, crf=None,
+    preset='medium', h265=False, jobs=1, segments=False, transforms=None, align_matrix=None,
+    align_method=None, reference='middle', **kwargs):
     """
     Generate timelapse video from images
 
@@ -56,22 +149,41 @@ def make_timelapse(folder='fovs', time_display='elapsed', time_format=None, time
         Y is the distance from the top edge of the image. Default will draw in the top-left corner.
     caption_xy : tuple of 2 int, default None
         Coordinates of the bottom-left corner of the first line of the caption. Default will draw in the bottom corner.
+    crf : int, default None
+        Set CRF (quality level) in ffmpeg. The default will use the
+        default value from ffmpeg.
+    preset : str, default 'medium'
+        Encoding preset in ffmpeg (e.g. 'ultrafast', 'fast', 'medium', 'slow', 'veryslow').
+        Slower presets provide a better compression.
+    h265 : bool, default False
+        Use H.265 encoding instead of H.264. H.265 offers a higher
+        compression, but may not be supported by some players/browsers.
+    jobs : int, default 1
+        Number of folders (FOVs) to process in parallel, each in a separate process.
+    segments : bool, default False
+        Write the timelapse as MPEG-TS segments and a HLS playlist (.m3u8), with a sidecar
+        .json index recording the last frame. When new frames are added, only the new frames
+        are encoded in a new segment, instead of rewriting the whole video. Segments are encoded
+        with H.264, as most HLS players do not support H.265 in MPEG-TS. Use ffmpeg to convert the playlist into a single
+        video (e.g. ffmpeg -i FOV.m3u8 -c copy FOV.mp4).
+    transforms : str, default None
+        Path to the output folder of 'align_frames' (e.g. 'fovs_aligned'). The transforms saved
+        in 'transforms.csv' are applied to the frames before encoding, so aligned frames do not
+        need to be saved. Frames without transforms (not aligned) are skipped.
+    align_matrix : a 2x3 matrix of np.float32 type
+        Perform an additional transformation after the alignment, if 'transforms' or 'align_method' is used.
+    align_method : {'ORB', 'ECC', 'ORB+ECC', 'PHASE'}, default None
+        Align frames while creating the timelapse, so each frame is read only once and no aligned frames are
+        saved. Check 'method' in 'align_frames' for details. Default will not align frames.
+    reference : {'first', 'middle', 'last', 'previousX'} or str, default 'middle'
+        Reference frame used if 'align_method' is set. Check 'align_frames' for details. When adding frames to
+        existing videos, use a fixed reference ('first' or a filename), as the other frames may change.
     **kwargs
         Arguments passed to other function. Possible options are 'font_weight' (ttf_opensans.opensans) and 'fill', 'spacing',
-        'anchor' and 'align' (PIL.ImageDraw.text).
-    """
-    defaultKwargs = dict(
-        fill=None,
-        anchor=None,
-        spacing=4,
-        align='left',
-        font_weight=400
-    )
-    
-    kwargs = {**defaultKwargs, **kwargs}
-
-    open_sans = opensans(font_weight=kwargs['font_weight'], italic=False)
-    font = open_sans.imagefont(size=font_size)
+        'anchor' and 'align' (PIL.ImageDraw.text). Options of 'align_frames' can also be used if 'align_method' is set. 'prefetch' sets the number of images decoded ahead in
+        background threads (default 4).
+    """
+    kwargs = {**DEFAULT_KWARGS, **kwargs}
 
     folder = Path(folder)
 
@@ -82,84 +194,206 @@ def make_timelapse(folder='fovs', time_display='elapsed', time_format=None, time
     if len(fu) == 0:
         fu = [folder]
 
-    if logo:
-        logoimg = cv2.imdecode(np.frombuffer(LOGO, np.uint8), cv2.IMREAD_COLOR)
-
     if time_display not in ['elapsed', 'current', 'none']:
         raise ValueError("'time_display' must be one of 'elapsed', 'current' or 'none'")
 
-    do_time = False if time_display == 'none' else True
+    if transforms is not None and align_method is not None:
+        raise ValueError("Only one of 'transforms' or 'align_method' can be used.")
 
-    if do_time:
+    if segments and h265:
+        raise ValueError("'h265' can't be used with 'segments', most HLS players "
+            "do not support H.265 in MPEG-TS segments.")
+
+    if time_display != 'none':
         time_offset = pd.to_timedelta(time_offset)
 
         if time_format is None:
             time_format = '%Y/%m/%d %Hh' if time_display == 'current' else '%d days %{H}h'
 
-    for f in tqdm(fu, desc='Processed folders'):
-        images = f.glob("*.jpg")
-        images = sorted(images)
-        if len(images) < 1:
-            continue
+    params = {'time_display': time_display,
+        'time_format': time_format,
+        'time_offset': time_offset,
+        'fps': fps,
+        'font_size': font_size,
+        'logo': logo,
+        'caption': caption,
+        'time_xy': time_xy,
+        'caption_xy': caption_xy,
+        'crf': crf,
+        'preset': preset,
+        'h265': h265,
+        'segments': segments,
+        'transforms': transforms,
+        'align_matrix': align_matrix,
+        'align': None if align_method is None else _align_params(align_method, kwargs),
+        'reference': reference,
+        'kwargs': kwargs
+    }
+
+    if jobs > 1 and len(fu) > 1:
+        # each folder is an independent video, process them in separate processes
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_make_timelapse_folder, f, params, i % jobs + 1)
+                       for i, f in enumerate(fu)]
+            for future in tqdm(as_completed(futures), total=len(futures), desc='Processed folders'):
+                future.result()
+    else:
+        for f in tqdm(fu, desc='Processed folders'):
+            _make_timelapse_folder(f, params)
 
-        if do_time:
-            timestamp0 = name_to_timestamp(images[0].name)
 
-        imgfile = images[0]
+def _make_timelapse_folder(f, params, position=None):
+    """
+    Generate the timelapse video for a single folder (FOV)
+    """
+    time_display = params['time_display']
+    time_format = params['time_format']
+    time_offset = params['time_offset']
+    fps = params['fps']
+    crf = params['crf']
+    preset = params['preset']
+    h265 = params['h265']
+    kwargs = params['kwargs']
 
-        # if the videos exists, will try to append
-        output_video = Path(f.name + '.mp4')
-        if output_video.exists():
-            ffprobe_cmd = ['ffprobe', '-v', 'quiet',
-                    '-select_streams', 'v:0',
-                    '-show_format',
-                    '-of', 'json',
-                    '-i', output_video]
-        
-            out_raw = sp.check_output(ffprobe_cmd)
-            out_dict = json.loads(out_raw)
-            first_last = json.loads(out_dict['format']['tags']['comment'])
-
-            index = next(i for i, img in enumerate(images) if img.name == first_last['Last frame']) + 1
-            images = images[index::]
+    open_sans = opensans(font_weight=kwargs['font_weight'], italic=False)
+    font = open_sans.imagefont(size=params['font_size'])
 
-            append = True
+    do_time = False if time_display == 'none' else True
+
+    images = f.glob("*.jpg")
+    images = sorted(images)
+
+    # only frames aligned can be used
+    if params['transforms'] is not None:
+        csv_file = Path(params['transforms']) / f.name / 'transforms.csv'
+        if not csv_file.exists():
+            csv_file = Path(params['transforms']) / 'transforms.csv'
+        if not csv_file.exists():
+            print(f"Skipping folder '{f}', transforms not found in '{params['transforms']}'.")
+            return
+
+        transforms = _read_transforms(csv_file)
+        images = [img for img in images if img.name in transforms]
+
+    if len(images) < 1:
+        return
+
+    # frames are aligned while encoding
+    align = params['align']
+    if align is not None:
+        ref_file, _, nupdate = _reference_file(f, images, params['reference'])
+        if ref_file is None:
+            print(f"Skipping folder '{f}', reference image '{params['reference']}' not found.")
+            return
 
-            if len(images) == 0:
-                print(f"Skipping file {output_video.name}. File already exists and no new frames to add.")
-                continue
+        img_ref = cv2.cvtColor(cv2.imread(str(ref_file), cv2.IMREAD_COLOR), cv2.COLOR_BGR2GRAY)
+        ref = _reference(img_ref, align['kwargs']['mask'], align)
+        naligned = 0
+
+    if do_time:
+        timestamp0 = name_to_timestamp(images[0].name)
+
+    imgfile = images[0]
+
+    # if the videos exists, will try to append
+    append = False
+    if params['segments']:
+        # the sidecar index has the segments already encoded
+        output_video = Path(f.name + '.m3u8')
+        index_file = Path(f.name + '.json')
+        if index_file.exists():
+            with open(index_file, encoding='utf-8') as fidx:
+                seg_index = json.load(fidx)
+            h265 = seg_index['h265']
+            last_frame = seg_index['Last frame']
         else:
-            append = False
+            seg_index = {'First frame': images[0].name, 'Last frame': None,
+                         'h265': h265, 'duration': 0, 'segments': []}
+            last_frame = None
 
-        # read one frame to get img size
-        img_ref = cv2.imread(str(imgfile), cv2.IMREAD_GRAYSCALE)
-        video_dim = img_ref.shape[::-1]
-        
-        tmpfile = tempfile.gettempdir() / output_video
-        vidwriter = cv2.VideoWriter(str(tmpfile), cv2.VideoWriter_fourcc(*"mp4v"), fps, video_dim)
+    elif Path(f.name + '.mp4').exists():
+        output_video = Path(f.name + '.mp4')
+        ffprobe_cmd = ['ffprobe', '-v', 'quiet',
+                '-select_streams', 'v:0',
+                '-show_entries', 'stream=codec_name:format_tags=comment',
+                '-of', 'json',
+                '-i', output_video]
+    
+        out_raw = sp.run(ffprobe_cmd, stdout=sp.PIPE, check=False).stdout
+        out_dict = json.loads(out_raw or '{}')
+        comment = out_dict.get('format', {}).get('tags', {}).get('comment')
+
+        if comment is None:
+            # e.g. encoding was interrupted, so the frames in the video are unknown
+            print(f"File {output_video.name} has no information of the frames encoded, "
+                "creating it again.")
+            last_frame = None
+        else:
+            first_last = json.loads(comment)
+            old_codec = out_dict['streams'][0]['codec_name']
+            last_frame = first_last['Last frame']
+            append = True
+    else:
+        output_video = Path(f.name + '.mp4')
+        last_frame = None
+
+    if last_frame is not None:
+        index = next(i for i, img in enumerate(images) if img.name == last_frame) + 1
+        images = images[index::]
+
+        if len(images) == 0:
+            print(f"Skipping file {output_video.name}. File already exists and no new frames to add.")
+            return
+
+    # read one frame to get img size
+    img_ref = cv2.imread(str(imgfile), cv2.IMREAD_GRAYSCALE)
+    video_dim = img_ref.shape[::-1]
+
+    # frames are encoded in a temporary folder and the video is only moved to the
+    # output when finished, so a failed encode doesn't leave a partial video. The
+    # folder is next to the output, so the video can be renamed and each FOV has
+    # its own temporary files
+    tmpdir = None
+    if params['segments']:
+        # new frames go in a new segment, starting where the previous ended
+        segment_file = Path(f"{f.name}_{len(seg_index['segments']):05d}.ts")
+        vidwriter = open_ffmpeg_writer(segment_file, *video_dim, fps, crf, preset, h265,
+            extra=['-output_ts_offset', str(seg_index['duration']), '-f', 'mpegts'])
+    else:
+        tmpdir = Path(tempfile.mkdtemp(prefix=f".{f.name}_", dir=output_video.resolve().parent))
+        tmpfile = tmpdir / output_video.name
+        if append:
+            vidwriter = open_ffmpeg_writer(tmpfile, *video_dim, fps, crf, preset, h265)
+        else:
+            metadata = {'First frame': images[0].name, 'Last frame': images[-1].name}
+            vidwriter = open_ffmpeg_writer(tmpfile, *video_dim, fps, crf, preset, h265,
+                json.dumps(metadata), extra=['-movflags', '+faststart'])
 
+    try:
         spacing = img_ref.shape[0] // 20 # 5% of the image size
 
-        if time_xy is None:
+        if params['time_xy'] is None:
             txy = (spacing, spacing)
             tanchor = None
             talign = "left"
         else:
-            txy = tuple(time_xy)
+            txy = tuple(params['time_xy'])
             tanchor = kwargs['anchor']
             talign = kwargs['align']
 
 
-        if caption_xy is None:
+        if params['caption_xy'] is None:
             cxy = (img_ref.shape[0]-spacing, img_ref.shape[1] // 2)
             canchor = 'md'
             calign = 'middle'
         else:
-            cxy = tuple(caption_xy)
+            cxy = tuple(params['caption_xy'])
             canchor = kwargs['anchor']
             calign = kwargs['align']
 
+        logo = params['logo']
         if logo:
+            logoimg = cv2.imdecode(np.frombuffer(LOGO, np.uint8), cv2.IMREAD_COLOR)
             size_logo = img_ref.shape[0] // 7 # 7.5% of the image size
             logo_resize = cv2.resize(logoimg, (size_logo,size_logo), interpolation=cv2.INTER_LINEAR)
 
@@ -170,84 +404,393 @@ def make_timelapse(folder='fovs', time_display='elapsed', time_format=None, time
             right_x = img_ref.shape[1] - spacing
 
 
-        # Start loop for each image
-        for imgfile in tqdm(images, leave=False):
+        # render text only once, timestamps are cached as they repeat often
+        caption = params['caption']
+        if caption is not None:
+            caption_overlay = _render_text(caption, cxy, font, canchor, calign,
+                                           kwargs['spacing'], kwargs['fill'])
 
-            # img = cv2.imread(str(imgfile), cv2.IMREAD_COLOR)
+        if do_time:
+            render_time = lru_cache(maxsize=1024)(partial(_render_text, xy=txy, font=font,
+                anchor=tanchor, align=talign, spacing=kwargs['spacing'], fill=kwargs['fill']))
 
-            img = Image.open(imgfile)  
-            draw = ImageDraw.Draw(img)
-            
+        # Start loop for each image, decoding next images in background
+        nwritten = 0
+        with closing(prefetch(_imread, images, kwargs['prefetch'])) as imgs:
+            for imgfile, img in tqdm(imgs, total=len(images), desc=f.name, position=position, leave=False):
 
-            # format timestamp of time lapsed string
-            if do_time:
-                timestamp = name_to_timestamp(imgfile.name)
+                if img is None:
+                    print(f"Skiping file {imgfile}. Could not read the image.")
+                    continue
 
-                if time_display == 'elapsed':
-                    timedelta = timestamp - timestamp0 + time_offset
-                    timestamp = strfdelta(timedelta, time_format)
-                else:
-                    timestamp = timestamp.strftime(time_format)
+                if params['transforms'] is not None:
+                    img = _warp_image(img, *transforms[imgfile.name], params['align_matrix'])
 
-                # Using cv2.putText() method
-                draw.text(txy, timestamp, fill=kwargs['fill'], font=font, anchor=tanchor,
-                          align=talign, spacing=kwargs['spacing'])
+                elif align is not None:
+                    transform = _estimate_transform(img, ref, align)
+                    if transform is None:
+                        print(f"Skiping file {imgfile}. Not enough matches found.")
+                        continue
 
-            if caption is not None:
-                draw.text(cxy, caption,fill=kwargs['fill'], font=font, anchor=canchor,
-                          align=calign, spacing=kwargs['spacing'])
-            
-            # convert Pillow to OpenCV
-            img = np.array(img)
-            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+                    # update reference with the aligned image, without the manual transformation
+                    naligned += 1
+                    if nupdate is not None and naligned % nupdate == 0:
+                        ref = _updated_reference(img, transform, align)
 
-            # insert logo
-            if logo:
-                # destination = img[top_y:bottom_y, left_x:right_x]
-                # result = cv2.addWeighted(destination, 1, logo_resize, 0.5, 0)
-                # img[top_y:bottom_y, left_x:right_x] = result
-                img[top_y:bottom_y, left_x:right_x] = logo_resize
+                    img = _warp_image(img, *transform, params['align_matrix'])
 
-            vidwriter.write(img)
+                if img.shape[1::-1] != video_dim:
+                    img = cv2.resize(img, video_dim, interpolation=cv2.INTER_LINEAR)
 
-        vidwriter.release()
+                # format timestamp of time lapsed string
+                if do_time:
+                    timestamp = name_to_timestamp(imgfile.name)
 
-        if append:
-            # i = 1
-            old_video = output_video.rename(Path(tempfile.gettempdir()) / 'old_video.mp4')
-            # while output_video.exists():
-            #     output_video = output_video.with_stem(f"{output_video.stem}_V{i}")
-            #     i += 1
-            
-            list_file = Path(tempfile.gettempdir()) / 'file_list.txt'
+                    if time_display == 'elapsed':
+                        timedelta = timestamp - timestamp0 + time_offset
+                        timestamp = strfdelta(timedelta, time_format)
+                    else:
+                        timestamp = timestamp.strftime(time_format)
+
+                    _blend_overlay(img, render_time(timestamp))
+
+                if caption is not None:
+                    _blend_overlay(img, caption_overlay)
+
+                # insert logo
+                if logo:
+                    # destination = img[top_y:bottom_y, left_x:right_x]
+                    # result = cv2.addWeighted(destination, 1, logo_resize, 0.5, 0)
+                    # img[top_y:bottom_y, left_x:right_x] = result
+                    img[top_y:bottom_y, left_x:right_x] = logo_resize
+
+                vidwriter.stdin.write(img.tobytes())
+                nwritten += 1
+
+        close_ffmpeg_writer(vidwriter)
+
+        if params['segments']:
+            # only frames written count for the duration of the segment
+            if nwritten > 0:
+                duration = nwritten / fps
+                seg_index['segments'].append({'file': segment_file.name, 'duration': duration,
+                    'First frame': images[0].name, 'Last frame': images[-1].name})
+                seg_index['duration'] += duration
+            else:
+                segment_file.unlink(missing_ok=True)
+            seg_index['Last frame'] = images[-1].name
+
+            with open(index_file, 'w', encoding='utf-8') as fidx:
+                json.dump(seg_index, fidx, indent=2)
+
+            if len(seg_index['segments']) > 0:
+                _write_playlist(output_video, seg_index['segments'])
+
+        elif append:
+            joined_video = tmpdir / 'joined_video.mp4'
+            list_file = tmpdir / 'file_list.txt'
 
             metadata = {'First frame': first_last['First frame'], 'Last frame': images[-1].name}
 
-            with open(list_file, "w") as f:
-                f.write(f"file '{old_video.resolve()}'\n")
-                f.write(f"file '{tmpfile}'\n")
+            with open(list_file, "w") as flist:
+                flist.write(f"file '{output_video.resolve()}'\n")
+                flist.write(f"file '{tmpfile}'\n")
+
+            # videos created with older versions (mp4v) must be re-encoded
+            if old_codec == ('hevc' if h265 else 'h264'):
+                codec = ['-c', 'copy']
+            else:
+                codec = ['-c:v', 'libx265' if h265 else 'libx264', '-preset', preset,
+                    '-pix_fmt', 'yuv420p'] + ([] if crf is None else ['-crf', str(crf)])
 
             cmd = ['ffmpeg', '-v', 'quiet', '-f', 'concat', '-safe', '0', '-i', list_file,
-                '-metadata', f"comment={json.dumps(metadata)}",
-                '-c', 'copy', output_video]
-            
+                '-metadata', f"comment={json.dumps(metadata)}"] + codec + [
+                '-movflags', '+faststart', joined_video]
+
             sp.run(cmd, check=True)
-            tmpfile.unlink()
-            old_video.unlink()
-            list_file.unlink()
+            joined_video.replace(output_video)
 
         else:
-            metadata = {'First frame': images[0].name, 'Last frame': images[-1].name}
+            tmpfile.replace(output_video)
 
-            cmd = ['ffmpeg', '-v', 'quiet', '-i', tmpfile, 
-                '-metadata', f"comment={json.dumps(metadata)}", 
-                '-c', 'copy', output_video]
+    finally:
+        # stop ffmpeg if encoding was interrupted
+        if vidwriter.poll() is None:
+            vidwriter.kill()
+            vidwriter.wait()
+        if tmpdir is not None:
+            rmtree(tmpdir, ignore_errors=True)
 
-            sp.run(cmd, check=True)
-            tmpfile.unlink()
 
+@lru_cache(maxsize=1)
+def _orb_matcher(nfeatures, index_params, search_params):
+    """
+    Create the ORB detector and FLANN matcher, only once in each process
+    """
+    orbd = cv2.ORB_create(nfeatures)
+    matcher = cv2.FlannBasedMatcher(dict(index_params), dict(search_params))
+    return orbd, matcher
 
-def align_frames(folder='fovs', method='ORB+ECC', reference='middle', align_matrix=None, **kwargs):
+
+def _estimate_transform(img, ref, params):
+    """
+    Estimate the transforms to align an image to the reference (gray image, keypoints and descriptors)
+    Return the affine matrix (ORB) and the homography (ECC), or None if alignment failed
+    """
+    kwargs = params['kwargs']
+    sz = (img.shape[1], img.shape[0])
+    img_gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    M = np.eye(2, 3, dtype=np.float32)
+    warp_matrix = np.eye(3, 3, dtype=np.float32)
+
+    # ===== 0. TRANSLATION ONLY USING PHASE CORRELATION =====
+    if params['phase']:
+        # some versions of openCV change the inputs in place, so the reference is copied
+        (dx, dy), response = cv2.phaseCorrelate(ref['phase'].copy(), _phase_image(img_gray, params['phase_scale']),
+                                                ref['window'])
+
+        # low response, image is not only translated, fall back to ORB+ECC
+        if response >= kwargs['phase_response']:
+            scale = params['phase_scale']
+            M = np.array([[1, 0, -dx / scale],
+                          [0, 1, -dy / scale]], dtype=np.float32)
+            return M, warp_matrix
+
+    # ===== 1. FEATURE-BASED ALIGNMENT USING ORB =====
+    if params['orb']:
+        orbd, matcher = _orb_matcher(*params['orb_matcher'])
+        kp2, des2 = orbd.detectAndCompute(img_gray, kwargs['mask'])
+
+        matches = matcher.knnMatch(ref['des'], des2, k=2)
+
+        # Apply Lowe's Ratio Test to filter good matches
+        matches = [m for m in matches if len(m) == 2]
+        good_matches = [m for m, n in matches if m.distance < 0.75 * n.distance]
+
+        if len(good_matches) < 10:
+            return None
+
+        src_pts = np.float32([ref['kp'][m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+        dst_pts = np.float32([kp2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
+
+        # Compute Homography
+        M , _= cv2.estimateAffinePartial2D(dst_pts, src_pts)
+        # M, _ = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, 5.0)
+
+        # constrain translation and scale only
+        scale_x = np.linalg.norm(M[:, 0])  # Scale factor along X
+        scale_y = np.linalg.norm(M[:, 1])  # Scale factor along Y
+        scale = (scale_x + scale_y) / 2  # Average scale
+        M = np.array([[scale, 0, M[0, 2]],
+                      [0, scale, M[1, 2]]], dtype=np.float32)
+
+        img_gray = cv2.warpAffine(img_gray, M, sz)
+
+    # ===== 2. FINE-TUNE ALIGNMENT USING ECC =====
+    if params['ecc']:
+        # ECC Image Alignment, coarse to fine
+        warp_matrix = _ecc_pyramid(ref['pyramid'], img_gray, params['criteria'], params['ecc_refine'])
+
+    return M, warp_matrix
+
+
+def _phase_image(img_gray, scale):
+    """
+    Downscale the image for phase correlation
+    """
+    img = cv2.resize(img_gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return img.astype(np.float32)
+
+
+def _warp_image(img, affine, homography, wmat=None):
+    """
+    Apply the alignment transforms, and the manual transformation
+    if requested, in a single warp
+    """
+    sz = (img.shape[1], img.shape[0])
+
+    # the ECC homography maps the aligned image to the ORB aligned image
+    T = np.linalg.inv(homography) @ np.vstack([affine, [0, 0, 1]])
+    if wmat is not None:
+        T = np.vstack([wmat, [0, 0, 1]]) @ T
+
+    return cv2.warpPerspective(img, T, sz, flags=cv2.INTER_LINEAR)
+
+
+def _ecc_pyramid(ref_pyramid, img_gray, criteria, refine):
+    """
+    Estimate the ECC homography in an image pyramid, starting in the coarsest
+    level and refining the estimate in each finer level
+    """
+    levels = len(ref_pyramid)
+    pyramid = [img_gray]
+    for _ in range(levels - 1):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+
+    # scale homography between pyramid levels
+    scale = np.array([[1, 1, 2], [1, 1, 2], [0.5, 0.5, 1]], dtype=np.float32)
+
+    warp_matrix = np.eye(3, 3, dtype=np.float32)
+    type_, max_count, epsilon = criteria
+    for level in range(levels - 1, -1, -1):
+        if level < levels - 1:
+            warp_matrix = warp_matrix * scale
+            # finer levels only refine the estimate, so need few iterations
+            max_count = refine
+        try:
+            _, warp_matrix = cv2.findTransformECC(ref_pyramid[level], pyramid[level], warp_matrix,
+                                                  cv2.MOTION_HOMOGRAPHY, (type_, max_count, epsilon))
+        except cv2.error:
+            # did not converge, keep the estimate from the coarser level
+            pass
+
+    return warp_matrix
+
+
+def _align_file(imgfile, out, ref, wmat, params, img=None):
+    """
+    Estimate the transforms of an image (read from imgfile if img is None),
+    saving the aligned image if requested. Return the transforms, or None
+    if alignment failed
+    """
+    if img is None:
+        img = cv2.imread(str(imgfile), cv2.IMREAD_COLOR)
+    if img is None:
+        print(f"Skiping file {imgfile}. Could not read the image.")
+        return None
+
+    transform = _estimate_transform(img, ref, params)
+    if transform is None:
+        print(f"Skiping file {imgfile}. Not enough matches found.")
+        return None
+
+    if params['save_images']:
+        img_algn = _warp_image(img, *transform, wmat)
+        cv2.imwrite(str(out / imgfile.name), img_algn, [cv2.IMWRITE_JPEG_QUALITY, 100])
+    return transform
+
+
+def _read_transforms(csv_file):
+    """
+    Read the transforms saved by align_frames
+    Return a dict of filename: (affine, homography)
+    """
+    df = pd.read_csv(csv_file)
+    values = df.iloc[:, 1:].to_numpy(dtype=np.float64)
+    return {name: (v[:6].reshape(2, 3), v[6:].reshape(3, 3))
+            for name, v in zip(df['filename'], values)}
+
+
+def _write_transforms(csv_file, rows):
+    """
+    Append the transforms of aligned images in the csv file
+    """
+    new_file = not csv_file.exists()
+    with open(csv_file, 'a', encoding="utf-8") as f:
+        if new_file:
+            f.write(TRANSFORMS_HEADER)
+        for name, (affine, homography) in rows:
+            values = np.concatenate([np.ravel(affine), np.ravel(homography)])
+            f.write(name + ',' + ','.join(f"{v:.10g}" for v in values) + '\n')
+
+
+def _updated_reference(img, transform, params):
+    """
+    Create a new reference from an image (BGR) and its transforms,
+    without the manual transformation
+    """
+    img_ref = cv2.cvtColor(_warp_image(img, *transform), cv2.COLOR_BGR2GRAY)
+    return _reference(img_ref, None, params)
+
+
+def _reference(img_ref, mask, params):
+    """
+    Compute the keypoints and descriptors of the reference image once,
+    so they can be shared with all images (and workers)
+    """
+    ref = {'gray': img_ref, 'kp': None, 'des': None, 'pyramid': None, 'phase': None, 'window': None}
+    if params['phase']:
+        ref['phase'] = _phase_image(img_ref, params['phase_scale'])
+        ref['window'] = cv2.createHanningWindow(ref['phase'].shape[::-1], cv2.CV_32F)
+    if params['orb']:
+        orbd, _ = _orb_matcher(*params['orb_matcher'])
+        ref['kp'], ref['des'] = orbd.detectAndCompute(img_ref, mask)
+    if params['ecc']:
+        ref['pyramid'] = [img_ref]
+        for _ in range(params['ecc_levels'] - 1):
+            ref['pyramid'].append(cv2.pyrDown(ref['pyramid'][-1]))
+    return ref
+
+
+def _align_params(method, kwargs, save_images=True):
+    """
+    Check the alignment method and create the parameters used to align frames
+    """
+    kwargs = {**DEFAULT_KWARGS, **kwargs}
+
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, kwargs['maxCount'], kwargs['epsilon'])
+    
+    phase = False
+    if method == 'ORB':
+        orb = True
+        ecc = False
+    elif method == 'ECC':
+        orb = False
+        ecc = True
+    elif method == 'ORB+ECC':
+        orb = True
+        ecc = True
+    elif method == 'PHASE':
+        # ORB+ECC is used if phase correlation fails
+        phase = True
+        orb = True
+        ecc = True
+    else:
+        raise ValueError("'method' must be either 'ORB', 'ECC', 'ORB+ECC' or 'PHASE'")
+
+    return {'orb': orb,
+        'ecc': ecc,
+        'phase': phase,
+        'phase_scale': kwargs['phase_scale'],
+        'criteria': criteria,
+        'save_images': save_images,
+        'ecc_levels': max(int(kwargs['ecc_levels']), 1),
+        'ecc_refine': max(int(kwargs['ecc_refine']), 1),
+        'orb_matcher': (kwargs['nfeatures'], tuple(kwargs['indexParams'].items()),
+                        tuple(kwargs['searchParams'].items())),
+        'kwargs': kwargs
+    }
+
+
+def _reference_file(f, images, ref):
+    """
+    Get the reference image of a folder. Return the reference file, if the file
+    is one of the images in the folder, and X of 'previousX' (None otherwise)
+    """
+    in_folder = True
+    nupdate = None
+    if ref == 'first':
+        imgfile = images[0]
+    elif ref == 'last':
+        imgfile = images[-1]
+    elif ref == 'middle':
+        imgfile = images[len(images) // 2]
+    elif ref.startswith('previous'):
+        imgfile = images[0]
+        nupdate = int(ref.replace('previous',''))
+    else:
+        imgfile = f / ref
+        if not imgfile.exists():
+            imgfile = Path(ref)
+            in_folder = False
+        if not imgfile.exists():
+            return None, False, None
+
+    return imgfile, in_folder, nupdate
+
+
+def align_frames(folder='fovs', method='ORB+ECC', reference='middle', align_matrix=None, jobs=1,
+    save_images=True, **kwargs):
     """
     Align frames
 
@@ -258,14 +801,21 @@ def align_frames(folder='fovs', method='ORB+ECC', reference='middle', align_matr
     ORB Feature Matching finds key points to align images and can handle large misalignments (translation, rotation, scale),
     but might not be precise. ECC can generate more precise alignment, but its much slower and often fails if there
     are large misalignments.
+    The transforms estimated for each frame are saved in the file 'transforms.csv' in the output folder,
+    with the affine matrix from ORB (a11-a23) and the homography from ECC (h11-h33). Use 'warp_frames'
+    to apply them again (e.g. with a different 'align_matrix'), or pass the output folder to the
+    'transforms' argument of 'make_timelapse' to align frames while creating the timelapse.
 
     Parameters
     ----------
     folder : str, default 'fovs'
         Path to a folder where .jpg images are stored.
-    method : {'ORB', 'ECC', 'ORB+ECC'}, default ORB+ECC
+    method : {'ORB', 'ECC', 'ORB+ECC', 'PHASE'}, default ORB+ECC
         Algorithm used for alignment: Feature Matching (ORB) or ECC Image Alignment.
-        'ORB+ECC' will perform ORB followed by ECC.
+        'ORB+ECC' will perform ORB followed by ECC. 'PHASE' will estimate only a translation
+        with phase correlation, which is much faster and suited for cameras that drift only by
+        small translations. If the phase correlation response is too low (e.g. the camera
+        also rotated or zoomed), 'ORB+ECC' is used for that frame.
     reference : {'first', 'middle', 'last', 'previousX'}, str or list of strs, default 'middle'
         Define the reference frame which other frames will be aligned to. Can define as the first, middle, or last frame
         of the folder, in chronological order. 'previousX' will update the reference image every X-th aligned image.
@@ -275,27 +825,29 @@ def align_frames(folder='fovs', method='ORB+ECC', reference='middle', align_matr
     align_matrix : a 2x3 matrix of np.float32 type
         Perform an additional transformation after the alignment. Useful if trying to center or zoon in the images.
         I suggest you use the 'Unified Transform' tool from GIMP to get the transform matrix.
+    jobs : int, default 1
+        Number of processes used to align the frames. The reference keypoints are computed
+        once and shared with all processes. With 'previousX', each segment of X frames is
+        aligned in parallel, before updating the reference.
+    save_images : bool, default True
+        Save the aligned frames. If False, only the transforms are saved.
     **kwargs
         Arguments passed to other function. Possible options are 'nfeatures' (cv2.ORB_create), 'mask' (detectAndCompute
         from cv2.ORB_create), indexParams and searchParams (cv2.FlannBasedMatcher) and epsilon and maxCount
-        (termination criteria for cv2.findTransformECC).
-    """
-    defaultKwargs = dict(
-        nfeatures = 5000,
-        epsilon = 1e-8, # 1e-5 and 1e-10
-        maxCount = 500, # 1000 - 5000
-        indexParams = dict(algorithm=6, table_number=6, key_size=12, multi_probe_level=1),
-        searchParams = dict(checks=50),
-        mask = None
-    )
-    
-    kwargs = {**defaultKwargs, **kwargs}
-
+        (termination criteria for cv2.findTransformECC). 'ecc_levels' sets the number of levels of the image pyramid
+        used by ECC (default 3): the warp is estimated in the coarsest level with up to maxCount iterations, and refined
+        in each finer level with up to 'ecc_refine' iterations (default 10). Use 1 to run ECC only in the full
+        resolution image. 'phase_scale' sets the downscale factor of the frames used in phase correlation (default 0.5),
+        and 'phase_response' the minimum response of the phase correlation to accept the shift (default 0.5).
+        'prefetch' sets the number of images decoded ahead in background threads (default 4).
+    """
     input_folder = Path(folder)
 
     if not input_folder.exists():
         raise ValueError(f"Folder {folder} not found.")
 
+    params = _align_params(method, kwargs, save_images)
+
     fu = [f for f in input_folder.iterdir() if f.is_dir()]
     output_folder = Path(folder + '_aligned')
     output_folder.mkdir(exist_ok=True)
@@ -311,22 +863,6 @@ def align_frames(folder='fovs', method='ORB+ECC', reference='middle', align_matr
         for out in fo:
             out.mkdir(exist_ok=True)
 
-    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, kwargs['maxCount'], kwargs['epsilon'])
-    
-    if method == 'ORB':
-        orb = True
-        ecc = False
-    elif method == 'ECC':
-        orb = False
-        ecc = True
-    elif method == 'ORB+ECC':
-        orb = True
-        ecc = True
-    else:
-        raise ValueError("'method' must be either 'ORB', 'ECC', or 'ORB+ECC'")
-    
-
-    manual_transform = align_matrix is not None
     if isinstance(align_matrix, list):
         if len(fu) != len(align_matrix):
             raise ValueError("If a list, 'align_matrix' must have same size as number of subfolder inside 'folder'.")
@@ -339,119 +875,165 @@ def align_frames(folder='fovs', method='ORB+ECC', reference='middle', align_matr
     else:
         reference = [reference] * len(fu)
 
-    orbd = cv2.ORB_create(kwargs['nfeatures'])  # ORB detector
+    # frames are aligned independently, so they can be processed in separate processes
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
 
-    # FLANN-based matcher
-    matcher = cv2.FlannBasedMatcher(kwargs['indexParams'], kwargs['searchParams'])
+    try:
+        for f, out, wmat, ref in zip(tqdm(fu, desc='Processed folders'), fo, align_matrix, reference):
+            _align_folder(f, out, wmat, ref, params, executor, jobs)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
-    for f, out, wmat, ref in zip(tqdm(fu, desc='Processed folders'), fo, align_matrix, reference):
-        images = f.glob("*.jpg")
-        images = sorted(images)
-        if len(images) < 1:
-            continue
 
-        # open reference image
-        update_reference = False
-        copy_ref = True
-        if ref == 'first':
-            imgfile = images[0]
-        elif ref == 'last':
-            imgfile = images[-1]
-        elif ref == 'middle':
-            imgfile = images[len(images) // 2]
-        elif ref.startswith('previous'):
-            imgfile = images[0]
-            update_reference = True
-            nupdate = int(ref.replace('previous',''))
-        else:
-            imgfile = f / ref
-            if not imgfile.exists():
-                imgfile = Path(ref)
-                copy_ref = False
-            if not imgfile.exists():
-                print(f"Skipping folder '{f}', reference image '{ref}' not found.")
-                continue
-
-        img_ref = cv2.imread(str(imgfile), cv2.IMREAD_COLOR)
-
-        # copy reference image into the output
-        if copy_ref:
-            images.remove(imgfile)
-            if manual_transform:
-                sz = (img_ref.shape[1], img_ref.shape[0])
-                img_algn = cv2.warpAffine(img_ref, wmat, sz, flags=cv2.INTER_LINEAR)
+def _align_folder(f, out, wmat, ref, params, executor=None, jobs=1):
+    """
+    Align all images of a folder (FOV)
+    """
+    kwargs = params['kwargs']
+    images = f.glob("*.jpg")
+    images = sorted(images)
+    if len(images) < 1:
+        return
+
+    # open reference image
+    imgfile, copy_ref, nupdate = _reference_file(f, images, ref)
+    if imgfile is None:
+        print(f"Skipping folder '{f}', reference image '{ref}' not found.")
+        return
+    update_reference = nupdate is not None
+
+    img_ref = cv2.imread(str(imgfile), cv2.IMREAD_COLOR)
+
+    # images already aligned are skipped
+    csv_file = out / 'transforms.csv'
+    done = set(_read_transforms(csv_file)) if csv_file.exists() else set()
+
+    # copy reference image into the output
+    if copy_ref:
+        images.remove(imgfile)
+        if imgfile.name not in done:
+            identity = (np.eye(2, 3), np.eye(3))
+            _write_transforms(csv_file, [(imgfile.name, identity)])
+            if params['save_images'] and wmat is not None:
+                img_algn = _warp_image(img_ref, *identity, wmat)
                 cv2.imwrite(str(out / imgfile.name), img_algn, [cv2.IMWRITE_JPEG_QUALITY, 100])
-            else:
+            elif params['save_images']:
                 copyfile(imgfile, out / imgfile.name)
 
-        img_ref = cv2.cvtColor(img_ref, cv2.COLOR_BGR2GRAY)
-        kp1, des1 = orbd.detectAndCompute(img_ref, kwargs['mask'])
-        
-        i = 0
-        for imgfile in tqdm(images, leave=False):
-            outimg = out / imgfile.name
-            if outimg.exists():
-                continue
-            
-            img = cv2.imread(str(imgfile), cv2.IMREAD_COLOR)
-            img_gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
-            sz = (img.shape[1], img.shape[0])
-
-            # ===== 1. FEATURE-BASED ALIGNMENT USING ORB =====
-            if orb:
-                kp2, des2 = orbd.detectAndCompute(img_gray, kwargs['mask'])
-
-                matches = matcher.knnMatch(des1, des2, k=2)
-
-                # Apply Lowe's Ratio Test to filter good matches
-                matches = [m for m in matches if len(m) == 2]
-                good_matches = [m for m, n in matches if m.distance < 0.75 * n.distance]
-
-                if len(good_matches) >= 10:
-                    src_pts = np.float32([kp1[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-                    dst_pts = np.float32([kp2[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-
-                    # Compute Homography
-                    M , _= cv2.estimateAffinePartial2D(dst_pts, src_pts)
-                    # M, _ = cv2.findHomography(dst_pts, src_pts, cv2.RANSAC, 5.0)
-
-                    # constrain translation and scale only
-                    scale_x = np.linalg.norm(M[:, 0])  # Scale factor along X
-                    scale_y = np.linalg.norm(M[:, 1])  # Scale factor along Y
-                    scale = (scale_x + scale_y) / 2  # Average scale
-                    M = np.array([[scale, 0, M[0, 2]],
-                                  [0, scale, M[1, 2]]], dtype=np.float32)
-                    
-                    img_algn = cv2.warpAffine(img, M, sz)
-                    # img_algn = cv2.warpPerspective(img, M, sz)
-                else:
-                    print(f"Skiping file {imgfile}. Not enough matches found.")
+    img_ref = cv2.cvtColor(img_ref, cv2.COLOR_BGR2GRAY)
+    ref = _reference(img_ref, kwargs['mask'], params)
+
+    # skip images already aligned, so they are not decoded
+    images = [imgfile for imgfile in images
+              if imgfile.name not in done and not (out / imgfile.name).exists()]
+
+    # with 'previousX', the reference is updated after every X images aligned,
+    # images that failed to be read or aligned are not counted
+    pbar = tqdm(total=len(images), leave=False)
+    naligned = 0
+    if executor is None:
+        # a single pool decodes the next images for the whole folder
+        rows = []
+        with closing(prefetch(_imread, images, kwargs['prefetch'])) as imgs:
+            for imgfile, img in imgs:
+                transform = _align_file(imgfile, out, ref, wmat, params, img)
+                pbar.update()
+                if transform is None:
                     continue
 
-            # ===== 2. FINE-TUNE ALIGNMENT USING ECC =====
-            if ecc:
-                img_gray = cv2.cvtColor(img_algn, cv2.COLOR_BGR2GRAY)
+                rows.append((imgfile.name, transform))
+                naligned += 1
+                if update_reference and naligned % nupdate == 0:
+                    _write_transforms(csv_file, rows)
+                    rows = []
+                    ref = _updated_reference(img, transform, params)
+
+        _write_transforms(csv_file, rows)
 
-                # ECC Image Alignment
-                warp_matrix = np.eye(3, 3, dtype=np.float32)
-                _, warp_matrix = cv2.findTransformECC(img_ref, img_gray, warp_matrix, cv2.MOTION_HOMOGRAPHY, criteria)
+    else:
+        pos = 0
+        while pos < len(images):
+            # only the images needed until the next reference update are sent
+            # together, and the reference is sent once for each chunk of images
+            if update_reference:
+                batch = images[pos:pos + nupdate - naligned % nupdate]
+            else:
+                batch = images[pos:]
+            pos += len(batch)
+
+            chunksize = max(1, len(batch) // (jobs * 4))
+            rows = []
+            for imgfile, transform in zip(batch, executor.map(
+                partial(_align_file, out=out, ref=ref, wmat=wmat, params=params),
+                batch, chunksize=chunksize)):
+                pbar.update()
+                if transform is not None:
+                    rows.append((imgfile, transform))
+
+            _write_transforms(csv_file, [(imgfile.name, t) for imgfile, t in rows])
+            naligned += len(rows)
+
+            # update reference with the last image aligned
+            if update_reference and len(rows) > 0 and naligned % nupdate == 0:
+                imgfile, transform = rows[-1]
+                img = cv2.imread(str(imgfile), cv2.IMREAD_COLOR)
+                ref = _updated_reference(img, transform, params)
+    pbar.close()
+
+
+def warp_frames(folder='fovs', align_matrix=None):
+    """
+    Warp frames using the transforms saved by 'align_frames'
 
-                img_algn = cv2.warpPerspective(img_algn, warp_matrix, sz, flags=cv2.INTER_LINEAR + cv2.WARP_INVERSE_MAP)
+    The transforms estimated by 'align_frames' are saved in the file 'transforms.csv' in
+    each output folder. This function will apply these transforms to the original frames,
+    so the alignment does not need to be estimated again, for example to create the aligned
+    frames after running 'align_frames' with save_images=False, or to change 'align_matrix'.
+    Aligned frames are saved in the folder with the suffix 'aligned', replacing existing frames.
 
-            # Perform manual transformation if requested
-            if manual_transform:
-                img_algn = cv2.warpAffine(img_algn, wmat, sz, flags=cv2.INTER_LINEAR)
+    Parameters
+    ----------
+    folder : str, default 'fovs'
+        Path to a folder where .jpg images are stored. The same folder used in 'align_frames'.
+    align_matrix : a 2x3 matrix of np.float32 type, or list of matrices
+        Perform an additional transformation after the alignment. Can be also a list with a matrix for
+        each subfolder inside 'folder'.
+    """
+    input_folder = Path(folder)
+    output_folder = Path(folder + '_aligned')
 
-            cv2.imwrite(str(outimg), img_algn, [cv2.IMWRITE_JPEG_QUALITY, 100])
+    if not input_folder.exists():
+        raise ValueError(f"Folder {folder} not found.")
 
-            # update reference
-            if update_reference:
-                i += 1
-                if i % nupdate == 0:
-                    img_ref = cv2.cvtColor(img_algn, cv2.COLOR_BGR2GRAY)
-                    kp1, des1 = orbd.detectAndCompute(img_ref, None)
+    fu = [f for f in input_folder.iterdir() if f.is_dir()]
+    if len(fu) == 0:
+        align_matrix = [align_matrix]
+        fu = [input_folder]
+        fo = [output_folder]
+    else:
+        fo = [output_folder / f.name for f in fu]
 
+    if isinstance(align_matrix, list):
+        if len(fu) != len(align_matrix):
+            raise ValueError("If a list, 'align_matrix' must have same size as number of subfolder inside 'folder'.")
+    else:
+        align_matrix = [align_matrix] * len(fu)
 
+    for f, out, wmat in zip(tqdm(fu, desc='Processed folders'), fo, align_matrix):
+        csv_file = out / 'transforms.csv'
+        if not csv_file.exists():
+            print(f"Skipping folder '{f}', file '{csv_file}' not found.")
+            continue
 
+        transforms = _read_transforms(csv_file)
+        images = [f / name for name in transforms]
 
+        with closing(prefetch(_imread, images)) as imgs:
+            for imgfile, img in tqdm(imgs, total=len(images), leave=False):
+                if img is None:
+                    print(f"Skiping file {imgfile}. Could not read the image.")
+                    continue
 
+                img_algn = _warp_image(img, *transforms[imgfile.name], wmat)
+                cv2.imwrite(str(out / imgfile.name), img_algn, [cv2.IMWRITE_JPEG_QUALITY, 100])
@@ -1,10 +1,15 @@
 from pathlib import Path
+import shutil
+from types import SimpleNamespace
+from unittest import mock
 import pytest
 import numpy as np
 import pandas as pd
 from oncvideo._arg_parser import main as parser
 from oncvideo._utils import URL, download_file
-from oncvideo.didson_file import read_ddf
+from oncvideo.didson_file import read_ddf, iter_ddf, DidsonFile, _read_ddf_info, FILE_HEADER
+from oncvideo.didson_video import fan_image, _framerate
+from oncvideo.didson_store import read_didson_h5
 
 FILE = 'DIDSON3000SN374_20221108T160900.221Z.ddf'
 
@@ -17,6 +22,16 @@ def setup_session(request):
     request.addfinalizer(finalizer_function)
 
 
+def write_ddf(path, **fields):
+    """Copy FILE changing fields of the file header, without frames if nframe is 0"""
+    data = Path(FILE).read_bytes()
+    header = np.frombuffer(data, dtype=FILE_HEADER, count=1).copy()
+    for name, value in fields.items():
+        header[name] = value
+    frames = data[FILE_HEADER.itemsize:] if header['nframe'][0] > 0 else b''
+    Path(path).write_bytes(header.tobytes() + frames)
+
+
 class TestDidsonInfo():
     def setup_class(self):
         parser([
@@ -31,10 +46,94 @@ class TestDidsonInfo():
     def test_nan(self):
         assert not self.df.isnull().any().any()
 
+    def test_pctime_utc(self):
+        with DidsonFile(FILE) as ddf:
+            pctime = ddf.pctime.iloc[[0, -1]].dt.strftime('%Y-%m-%d %H:%M:%S').tolist()
+        assert self.df[['PCtimeFrom', 'PCtimeTo']].iloc[0].tolist() == pctime
+
     def teardown_class(self):
         Path("DIDSON_info.csv").unlink()
 
 
+class TestDidsonInfoSample():
+    def setup_class(self):
+        parser([
+                "didson",
+                FILE,
+                "-s", "10",
+                "-o", "DIDSON_info_sample.csv"
+              ])
+        self.df = pd.read_csv("DIDSON_info_sample.csv")
+
+    def test_shape(self):
+        assert self.df.shape == (1, 11)
+
+    def test_nan(self):
+        assert not self.df.isnull().any().any()
+
+    def teardown_class(self):
+        Path("DIDSON_info_sample.csv").unlink()
+
+
+class FakeServer():
+    """
+    Answer requests.get with the bytes of a file, as a server that supports
+    multiple ranges ('multipart'), only one range ('single'), no ranges ('none')
+    or that answers only the first of multiple ranges ('first')
+    """
+    def __init__(self, path, mode):
+        self.data = Path(path).read_bytes()
+        self.mode = mode
+        self.requests = 0
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests += 1
+        ranges = []
+        if headers is not None and 'Range' in headers:
+            ranges = [tuple(map(int, r.split('-'))) for r in headers['Range'][6:].split(',')]
+
+        if self.mode == 'none' or len(ranges) == 0 or (self.mode == 'single' and len(ranges) > 1):
+            return SimpleNamespace(status_code=200, headers={}, content=self.data, close=lambda: None)
+
+        size = len(self.data)
+        if len(ranges) == 1 or self.mode == 'first':
+            start, end = ranges[0]
+            return SimpleNamespace(status_code=206, content=self.data[start:end + 1], close=lambda: None,
+                headers={'Content-Range': f'bytes {start}-{end}/{size}'})
+
+        content = b''
+        for start, end in ranges:
+            content += (b'\r\n--BOUNDARY\r\nContent-Type: application/octet-stream\r\n'
+                b'Content-Range: bytes %d-%d/%d\r\n\r\n' % (start, end, size)) + self.data[start:end + 1]
+        content += b'\r\n--BOUNDARY--\r\n'
+        return SimpleNamespace(status_code=206, content=content, close=lambda: None,
+            headers={'Content-Type': 'multipart/byteranges; boundary=BOUNDARY'})
+
+
+class TestDidsonRanges():
+    def setup_class(self):
+        self.info = _read_ddf_info(FILE)
+        self.info_sample = _read_ddf_info(FILE, 10)
+
+    @pytest.mark.parametrize("mode", ['multipart', 'single', 'none', 'first'])
+    def test_info(self, mode):
+        server = FakeServer(FILE, mode)
+        with mock.patch('oncvideo.didson_file.requests.get', server.get):
+            assert _read_ddf_info('https://example.com/' + FILE) == self.info
+            assert _read_ddf_info('https://example.com/' + FILE, 10) == self.info_sample
+
+    @pytest.mark.parametrize("mode", ['multipart', 'single', 'none', 'first'])
+    def test_window(self, mode):
+        time = read_ddf(FILE, lazy=True)[0]
+        window = read_ddf(FILE, time_from=time.iloc[10], time_to=time.iloc[20])
+        server = FakeServer(FILE, mode)
+        with mock.patch('oncvideo.didson_file.requests.get', server.get):
+            out = read_ddf('https://example.com/' + FILE, time_from=time.iloc[10],
+                time_to=time.iloc[20])
+        assert out[0].equals(window[0])
+        assert np.array_equal(out[1], window[1])
+
+
 class TestDidsonRead():
     def setup_class(self):
         self.out = read_ddf(FILE)
@@ -50,3 +149,222 @@ class TestDidsonRead():
 
     def test_array_nan(self):
         assert not np.isnan(self.out[1]).any()
+
+
+class TestDidsonReadLazy():
+    def setup_class(self):
+        self.out = read_ddf(FILE)
+        self.lazy = read_ddf(FILE, lazy=True)
+
+    def test_ts(self):
+        assert self.lazy[0].equals(self.out[0])
+
+    def test_array_shape(self):
+        assert self.lazy[1].shape == (3447, 96, 512)
+
+    def test_no_copy(self):
+        assert not self.lazy[1].flags['OWNDATA']
+
+    def test_array_values(self):
+        assert np.array_equal(self.lazy[1][100:110], self.out[1][100:110])
+        assert np.array_equal(self.lazy[1][:, 10], self.out[1][:, 10])
+
+
+class TestDidsonReadTime():
+    def setup_class(self):
+        self.out = read_ddf(FILE)
+        self.time_from, self.time_to = self.out[0].iloc[1000], self.out[0].iloc[1999]
+        self.window = read_ddf(FILE, time_from=self.time_from, time_to=self.time_to)
+
+    def test_ts(self):
+        assert len(self.window[0]) == 1000
+        assert self.window[0].iloc[0] == self.time_from
+        assert self.window[0].iloc[-1] == self.time_to
+
+    def test_array_values(self):
+        assert np.array_equal(self.window[1], self.out[1][1000:2000])
+
+    def test_open_window(self):
+        time, frames = read_ddf(FILE, lazy=True, time_from=self.time_to)
+        assert len(time) == 3447 - 1999
+        assert frames.shape == (3447 - 1999, 96, 512)
+
+    def test_aware_window(self):
+        time_from = self.time_from.tz_localize('UTC').tz_convert('America/Vancouver')
+        time, frames = read_ddf(FILE, time_from=time_from, time_to=self.time_to.tz_localize('UTC'))
+        assert time.equals(self.window[0])
+        assert np.array_equal(frames, self.window[1])
+
+
+class TestDidsonIter():
+    def setup_class(self):
+        self.out = read_ddf(FILE)
+        self.batches = [(time, frames.copy()) for time, frames in iter_ddf(FILE, 1000)]
+
+    def test_batch_size(self):
+        assert [len(frames) for _, frames in self.batches] == [1000, 1000, 1000, 447]
+
+    def test_ts(self):
+        time = pd.concat([time for time, _ in self.batches], ignore_index=True)
+        assert time.equals(self.out[0])
+
+    def test_array_values(self):
+        frames = np.concatenate([frames for _, frames in self.batches])
+        assert np.array_equal(frames, self.out[1])
+
+
+class TestDidsonFile():
+    def setup_class(self):
+        self.out = read_ddf(FILE)
+        self.ddf = DidsonFile(FILE)
+
+    def test_len(self):
+        assert len(self.ddf) == 3447
+
+    def test_attributes(self):
+        assert self.ddf.num_beams == 96
+        assert self.ddf.num_samples == 512
+        assert len(self.ddf.offsets) == 3447
+
+    def test_index(self):
+        assert np.array_equal(self.ddf[10], self.out[1][10])
+        assert np.array_equal(self.ddf[10:20], self.out[1][10:20])
+
+    def test_time_index(self):
+        time = self.out[0]
+        frames = self.ddf[time[10]:time[19]]
+        assert np.array_equal(frames, self.out[1][10:20])
+        assert np.array_equal(self.ddf[time[10]], self.out[1][10])
+
+    def test_aware_time_index(self):
+        time = self.out[0].dt.tz_localize('UTC').dt.tz_convert('America/Vancouver')
+        frames = self.ddf[time[10]:time[19]]
+        assert np.array_equal(frames, self.out[1][10:20])
+        assert self.ddf.frame_index(time[10]) == 10
+
+    def test_iter_chunks(self):
+        n = sum(len(frames) for _, frames in self.ddf.iter_chunks(1000))
+        assert n == 3447
+
+    def teardown_class(self):
+        self.ddf.close()
+
+
+class TestDidsonVideo():
+    def setup_class(self):
+        parser([
+                "videoDIDSON",
+                FILE,
+                "-w", "200"
+              ])
+        self.df = pd.read_csv(Path("DIDSON_video") / "DIDSON_video.csv")
+
+    def test_shape(self):
+        assert self.df.shape == (1, 4)
+
+    def test_video(self):
+        assert (Path("DIDSON_video") / Path(FILE).with_suffix('.mp4')).exists()
+
+    def test_fan_image(self):
+        time, frames = read_ddf(FILE, lazy=True)
+        img = fan_image(frames[0], 3.0, 10.0, width=200)
+        assert img.shape[1] == 200
+        assert img.dtype == np.uint8
+        assert img[0, 0] == 0
+
+    def test_no_framerate(self):
+        write_ddf("no_framerate.ddf", framerate=0)
+        with DidsonFile("no_framerate.ddf") as ddf:
+            assert _framerate(ddf) == pytest.approx(
+                1 / ddf.time.diff().median().total_seconds())
+        parser([
+                "videoDIDSON",
+                "no_framerate.ddf",
+                "-w", "200",
+                "-o", "DIDSON_video_no_framerate"
+              ])
+        assert (Path("DIDSON_video_no_framerate") / "no_framerate.mp4").exists()
+
+    def teardown_class(self):
+        shutil.rmtree("DIDSON_video")
+        shutil.rmtree("DIDSON_video_no_framerate", ignore_errors=True)
+        Path("no_framerate.ddf").unlink(missing_ok=True)
+
+
+class TestDidsonConvert():
+    def setup_class(self):
+        pytest.importorskip("h5py")
+        parser([
+                "convertDIDSON",
+                FILE
+              ])
+        self.out = read_ddf(FILE)
+        self.h5file = Path("DIDSON_h5") / Path(FILE).with_suffix('.h5')
+
+    def test_csv(self):
+        df = pd.read_csv(Path("DIDSON_h5") / "DIDSON_h5.csv")
+        assert df.shape == (1, 3)
+
+    def test_values(self):
+        time, frames = read_didson_h5(self.h5file)
+        assert time.equals(self.out[0])
+        assert np.array_equal(frames, self.out[1])
+
+    def test_time_window(self):
+        time_from, time_to = self.out[0].iloc[100], self.out[0].iloc[199]
+        time, frames = read_didson_h5(self.h5file, time_from, time_to)
+        assert len(time) == 100
+        assert np.array_equal(frames, self.out[1][100:200])
+
+    def test_no_frames(self):
+        write_ddf("no_frames.ddf", nframe=0)
+        parser([
+                "convertDIDSON",
+                "no_frames.ddf",
+                "-o", "DIDSON_h5_no_frames"
+              ])
+        time, frames = read_didson_h5(Path("DIDSON_h5_no_frames") / "no_frames.h5")
+        assert len(time) == 0
+        assert frames.shape == (0, 96, 512)
+
+    def teardown_class(self):
+        shutil.rmtree("DIDSON_h5")
+        shutil.rmtree("DIDSON_h5_no_frames", ignore_errors=True)
+        Path("no_frames.ddf").unlink(missing_ok=True)
+
+
+class TestDidsonSummary():
+    def setup_class(self):
+        parser([
+                "summaryDIDSON",
+                FILE
+              ])
+        self.df = pd.read_csv(Path("DIDSON_summary") / "DIDSON_summary.csv")
+
+    def test_shape(self):
+        assert self.df.shape == (1, 8)
+
+    def test_frames(self):
+        assert self.df['frames'].iloc[0] == 3447
+
+    def test_images(self):
+        name = Path(FILE).stem
+        for image in ('mean', 'max', 'echogram'):
+            assert (Path("DIDSON_summary") / f"{name}_{image}.png").exists()
+
+    def test_no_frames(self):
+        write_ddf("no_frames.ddf", nframe=0)
+        parser([
+                "summaryDIDSON",
+                "no_frames.ddf",
+                "-o", "DIDSON_summary_no_frames"
+              ])
+        df = pd.read_csv(Path("DIDSON_summary_no_frames") / "DIDSON_summary_no_frames.csv")
+        assert df.shape == (1, 8)
+        assert df['frames'].iloc[0] == 0
+        assert df['mean_intensity'].isnull().all()
+
+    def teardown_class(self):
+        shutil.rmtree("DIDSON_summary")
+        shutil.rmtree("DIDSON_summary_no_frames", ignore_errors=True)
+        Path("no_frames.ddf").unlink(missing_ok=True)
@@ -0,0 +1,225 @@
+from pathlib import Path
+import json
+import shutil
+import pytest
+import numpy as np
+import cv2
+import pandas as pd
+from oncvideo import make_timelapse, align_frames, warp_frames
+from oncvideo._arg_parser import main as parser
+
+FOLDER = Path("fovs_timelapse")
+SEG_FOLDER = Path("fovs_segments")
+ALIGN_FOLDER = Path("fovs_align")
+
+
+def write_images(folder, start, stop):
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    for i in range(start, stop):
+        img = np.roll(background, i, axis=1)
+        cv2.imwrite(str(folder / f"CAMERA_20220101T{i:02d}0000.000Z.jpg"), img)
+
+
+def write_shifted_images(folder, start, stop):
+    """Images of the same smooth texture, shifted i pixels to the right in image i"""
+    folder.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (240, 320, 3), dtype=np.uint8), (0, 0), 2)
+    background = cv2.normalize(background, None, 0, 255, cv2.NORM_MINMAX)
+    for i in range(start, stop):
+        shift = np.float32([[1, 0, i], [0, 1, 0]])
+        img = cv2.warpAffine(background, shift, (320, 240), borderMode=cv2.BORDER_REFLECT)
+        cv2.imwrite(str(folder / f"CAMERA_20220101T{i:02d}0000.000Z.jpg"), img)
+
+
+def read_transforms(folder):
+    return pd.read_csv(Path(folder) / "transforms.csv").sort_values('filename', ignore_index=True)
+
+
+def read_frames(video):
+    cap = cv2.VideoCapture(str(video))
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return np.array(frames, dtype=float)
+
+
+def count_frames(video):
+    cap = cv2.VideoCapture(str(video))
+    n = 0
+    while cap.read()[0]:
+        n += 1
+    cap.release()
+    return n
+
+
+class TestTimelapse():
+    def setup_class(self):
+        write_images(FOLDER / "FOV1", 0, 10)
+        parser([
+                "timelapse",
+                str(FOLDER),
+                "-t", "current"
+              ])
+
+    def test_video(self):
+        assert count_frames("FOV1.mp4") == 10
+
+    def test_append(self):
+        write_images(FOLDER / "FOV1", 10, 15)
+        parser([
+                "timelapse",
+                str(FOLDER),
+                "-t", "current"
+              ])
+        assert count_frames("FOV1.mp4") == 15
+
+    def test_partial_video(self):
+        # a video without the frames information (e.g. interrupted) is created again
+        write_images(FOLDER / "FOV2", 0, 5)
+        Path("FOV2.mp4").write_bytes(b'partial')
+        parser([
+                "timelapse",
+                str(FOLDER),
+                "-t", "current"
+              ])
+        assert count_frames("FOV2.mp4") == 5
+
+    def teardown_class(self):
+        shutil.rmtree(FOLDER)
+        for video in ("FOV1.mp4", "FOV2.mp4"):
+            Path(video).unlink(missing_ok=True)
+
+
+class TestTimelapseSegments():
+    def setup_class(self):
+        write_images(SEG_FOLDER / "SEG1", 0, 10)
+        parser([
+                "timelapse",
+                str(SEG_FOLDER),
+                "-t", "none",
+                "-s"
+              ])
+
+    def test_playlist(self):
+        playlist = Path("SEG1.m3u8").read_text()
+        assert "#EXT-X-PLAYLIST-TYPE:VOD" in playlist
+        assert playlist.rstrip().endswith("#EXT-X-ENDLIST")
+        assert count_frames("SEG1_00000.ts") == 10
+
+    def test_append(self):
+        # only the new frames are encoded, in a new segment
+        write_images(SEG_FOLDER / "SEG1", 10, 15)
+        parser([
+                "timelapse",
+                str(SEG_FOLDER),
+                "-t", "none",
+                "-s"
+              ])
+        with open("SEG1.json", encoding="utf-8") as f:
+            index = json.load(f)
+        assert [seg['file'] for seg in index['segments']] == ["SEG1_00000.ts", "SEG1_00001.ts"]
+        assert index['duration'] == pytest.approx(1.5)
+        assert count_frames("SEG1_00001.ts") == 5
+        assert "SEG1_00001.ts" in Path("SEG1.m3u8").read_text()
+
+    def test_h265(self):
+        with pytest.raises(ValueError):
+            make_timelapse(str(SEG_FOLDER), segments=True, h265=True)
+
+    def teardown_class(self):
+        shutil.rmtree(SEG_FOLDER)
+        for file in Path().glob("SEG1*"):
+            file.unlink()
+
+
+class TestAlignFrames():
+    def setup_class(self):
+        write_shifted_images(ALIGN_FOLDER / "FOV1", 0, 6)
+
+    @pytest.mark.parametrize("reference", ['middle', 'previous2'])
+    def test_parallel(self, reference):
+        # frames aligned in separate processes get the same transforms
+        align_frames(str(ALIGN_FOLDER), 'ORB', reference, save_images=False)
+        serial = read_transforms(f"{ALIGN_FOLDER}_aligned/FOV1")
+        shutil.rmtree(f"{ALIGN_FOLDER}_aligned")
+
+        align_frames(str(ALIGN_FOLDER), 'ORB', reference, jobs=2, save_images=False)
+        parallel = read_transforms(f"{ALIGN_FOLDER}_aligned/FOV1")
+        shutil.rmtree(f"{ALIGN_FOLDER}_aligned")
+
+        assert len(serial) == 6
+        assert serial['filename'].equals(parallel['filename'])
+        assert np.allclose(serial.iloc[:, 1:], parallel.iloc[:, 1:], atol=0.1)
+
+    def test_phase(self):
+        # image i is shifted i pixels from the first, so only a translation is estimated
+        align_frames(str(ALIGN_FOLDER), 'PHASE', 'first', save_images=False)
+        transforms = read_transforms(f"{ALIGN_FOLDER}_aligned/FOV1")
+        shutil.rmtree(f"{ALIGN_FOLDER}_aligned")
+
+        assert np.allclose(transforms['a13'], -np.arange(6), atol=1)
+        assert np.allclose(transforms['a23'], 0, atol=1)
+        assert (transforms[['a11', 'a22', 'h11', 'h22', 'h33']] == 1).all().all()
+        assert (transforms[['a12', 'a21', 'h12', 'h13', 'h21', 'h23', 'h31', 'h32']] == 0).all().all()
+
+    def test_phase_fallback(self):
+        # with a response that can't be reached, ORB+ECC is used for all frames
+        align_frames(str(ALIGN_FOLDER), 'PHASE', 'first', save_images=False, phase_response=2)
+        transforms = read_transforms(f"{ALIGN_FOLDER}_aligned/FOV1")
+        shutil.rmtree(f"{ALIGN_FOLDER}_aligned")
+
+        assert len(transforms) == 6
+        assert (transforms['h13'].iloc[1:] != 0).all()
+
+    def test_timelapse_align(self):
+        # frames aligned while encoding are closer to the reference than the original frames
+        make_timelapse(str(ALIGN_FOLDER), 'none')
+        original = read_frames("FOV1.mp4")
+        Path("FOV1.mp4").unlink()
+        make_timelapse(str(ALIGN_FOLDER), 'none', align_method='PHASE', reference='first',
+            phase_scale=1, prefetch=1)
+        aligned = read_frames("FOV1.mp4")
+        Path("FOV1.mp4").unlink()
+
+        assert len(aligned) == 6
+        error = lambda frames: np.abs(frames[-1, 20:-20, 20:-20] - frames[0, 20:-20, 20:-20]).mean()
+        assert error(aligned) < error(original) / 2
+
+    def test_warp(self):
+        # frames warped with the saved transforms are the same as the aligned frames
+        align_frames(str(ALIGN_FOLDER), 'ORB', 'first')
+        out = Path(f"{ALIGN_FOLDER}_aligned/FOV1")
+        aligned = {img.name: img.read_bytes() for img in out.glob("*.jpg")}
+        for img in out.glob("*.jpg"):
+            img.unlink()
+
+        # an image listed in transforms.csv, but missing, is skipped
+        transforms = read_transforms(out)
+        missing = transforms.iloc[[0]].assign(filename="CAMERA_20220101T990000.000Z.jpg")
+        pd.concat([transforms, missing]).to_csv(out / "transforms.csv", index=False)
+
+        warp_frames(str(ALIGN_FOLDER))
+        warped = {img.name: img.read_bytes() for img in out.glob("*.jpg")}
+        assert len(aligned) == 6
+        assert warped.keys() == aligned.keys()
+        # the reference (first) is copied by align_frames, but encoded again by warp_frames
+        reference = min(aligned)
+        assert all(warped[name] == aligned[name] for name in aligned if name != reference)
+
+    def test_timelapse_transforms(self):
+        align_frames(str(ALIGN_FOLDER), 'ORB', 'first', save_images=False)
+        make_timelapse(str(ALIGN_FOLDER), 'none', transforms=f"{ALIGN_FOLDER}_aligned")
+        assert count_frames("FOV1.mp4") == 6
+        Path("FOV1.mp4").unlink()
+        shutil.rmtree(f"{ALIGN_FOLDER}_aligned")
+
+    def teardown_class(self):
+        shutil.rmtree(ALIGN_FOLDER)
+        shutil.rmtree(f"{ALIGN_FOLDER}_aligned", ignore_errors=True)
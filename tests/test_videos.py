@@ -3,6 +3,7 @@ import shutil
 import pytest
 import pandas as pd
 from oncvideo._arg_parser import main as parser
+from oncvideo import iter_frames
 
 class TestDownload():
     def setup_class(self):
@@ -115,6 +116,127 @@ class TestExtractFrame():
         shutil.rmtree("frames")
 
 
+class TestExtractFrameScene():
+    def setup_class(self):
+        parser([
+                "extframe",
+                "videos/VS000170/*.mp4",
+                "60",
+                "-o",
+                "frames_scene",
+                "-s",
+                "0.3"
+              ])
+        self.df = pd.read_csv("frames_scene/frames_scene.csv")
+
+    def test_csv(self):
+        assert self.df.shape[1] == 5
+
+    def test_reason(self):
+        assert self.df['reason'].iloc[0] == 'first'
+        assert self.df['reason'].isin(['first', 'scene', 'interval']).all()
+
+    def test_max_gap(self):
+        gap = pd.to_datetime(self.df['timestamp']).diff().dt.total_seconds()
+        assert gap.max() <= 60
+
+    def test_files(self):
+        p = Path('frames_scene').glob('*.jpg')
+        assert len(list(p)) == self.df.shape[0]
+
+    def teardown_class(self):
+        shutil.rmtree("frames_scene")
+
+
+class TestExtractFrameDedupe():
+    def setup_class(self):
+        parser([
+                "extframe",
+                "videos/VS000170/*.mp4",
+                "30",
+                "-o",
+                "frames_dedupe",
+                "-u",
+                "5"
+              ])
+        self.df = pd.read_csv("frames_dedupe/frames_dedupe.csv")
+
+    def test_csv(self):
+        assert self.df.shape == (31, 4)
+
+    def test_files(self):
+        p = Path('frames_dedupe').glob('*.jpg')
+        assert len(list(p)) == self.df['duplicate_of'].isnull().sum()
+
+    def teardown_class(self):
+        shutil.rmtree("frames_dedupe")
+
+
+class TestExtractFrameHdf5():
+    def setup_class(self):
+        self.h5py = pytest.importorskip("h5py")
+        parser([
+                "extframe",
+                "videos/*.mp4",
+                "30",
+                "-o",
+                "frames_h5",
+                "-f",
+                "hdf5"
+              ])
+
+    def test_csv(self):
+        df = pd.read_csv("frames_h5/frames_h5.csv")
+        assert df.shape == (124, 4)
+
+    def test_store(self):
+        with self.h5py.File("frames_h5/frames_h5.h5") as f:
+            assert f['VS000169/frames'].shape[0] == 93
+            assert f['VS000170/timestamp'].shape[0] == 31
+
+    def teardown_class(self):
+        shutil.rmtree("frames_h5")
+
+
+class TestIterFrames():
+    def setup_class(self):
+        self.out = list(iter_frames("videos/VS000170/*.mp4", 30, resize=(64, 36)))
+
+    def test_length(self):
+        assert len(self.out) == 31
+
+    def test_device(self):
+        assert self.out[0][1] == 'INSPACMINIZEUS4KCAMODYSSEUS'
+
+    def test_frame(self):
+        assert self.out[0][2].shape == (36, 64, 3)
+
+
+class TestThumbnails():
+    def setup_class(self):
+        parser([
+                "thumbnails",
+                "videos/VS000170/*.mp4",
+                "30"
+              ])
+
+    def test_csv(self):
+        df = pd.read_csv("thumbnails/thumbnails.csv")
+        assert df.shape == (1, 4)
+        assert df.loc[0, 'thumbnails'] == 31
+
+    def test_sheets(self):
+        p = Path('thumbnails').glob('*.jpg')
+        assert len(list(p)) == 1
+
+    def test_vtt(self):
+        p = Path('thumbnails').glob('*.vtt')
+        assert len(list(p)) == 1
+
+    def teardown_class(self):
+        shutil.rmtree("thumbnails")
+
+
 class TestExtractFov():
     def setup_class(self):
         parser([
@@ -138,3 +260,33 @@ class TestExtractFov():
 
     def teardown_class(self):
         shutil.rmtree("fovs")
+
+
+class TestExtractFovDedupe():
+    def setup_class(self):
+        # the second video has fewer FOVs than the others
+        df = pd.read_csv("tests/videos_test.csv").drop(columns='group').iloc[:3]
+        df['fovs'] = ['00:30,00:45', '00:30', '00:30,00:45']
+        df.to_csv("fovs_varying.csv", index=False)
+        parser([
+                "extfov",
+                "fovs_varying.csv",
+                "-o",
+                "fovs_dedupe",
+                "-u",
+                "5"
+              ])
+        self.df = pd.read_csv("fovs_dedupe/fovs_dedupe.csv")
+
+    def test_csv(self):
+        assert self.df.shape == (3, 5)
+        with open("fovs_dedupe/fovs_dedupe.csv", encoding="utf-8") as f:
+            assert all(line.count(',') == 4 for line in f)
+
+    def test_padding(self):
+        assert self.df[['FOV2', 'FOV2_duplicate_of']].iloc[1].isnull().all()
+        assert self.df['FOV1'].notnull().all()
+
+    def teardown_class(self):
+        shutil.rmtree("fovs_dedupe")
+        Path("fovs_varying.csv").unlink()